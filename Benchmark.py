@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Filename: Benchmark.py
+Author: John DeMastri
+Create Date: 2025-05-12
+Version: 0.1
+Description: Timing harness for the cpu bound parts of the tool.  Works from pages already in the html cache, so it
+needs no browser or login.  Usage:
+    python Benchmark.py <benchmark> [-htmlroot <path>] [-cache <files|packed>] [-courses <ids>] [-limit <n>]
+                                    [-synthetic <n>] [-save]
+  parsers - parse and render cached variation pages with each installed bs4 backend, and check they give the same pgn
+  extract - parse whole variation pages vs only the extracted move parts, timing and peak memory
+  postprocess - time the chessbase workaround passes on the biggest cached games, and on those games repeated to
+    make very large ones (time per KB should stay flat as the games grow)
+  movebody - time buildMoveBody on the biggest cached games, and on those games' moves nested inside each other as
+    deeper and deeper variations (time per KB should stay flat as the nesting grows)
+  suite - times the pgn engine (createPgnFromHtml, findLastMove, escapeLastNumberInComments) and a cache hit through
+    getHtml on synthetic pages, and checks the pgn and the timings against Benchmark-baseline.json.  Needs no cache.
+    -save writes the results as the new baseline.  Timings depend on the machine - save a baseline on yours first
+-synthetic <n> runs any of the others on n synthetic pages (see SyntheticHtml.py) instead of the html cache
+
+License: MIT License
+Contact: chess@demastri.com
+"""
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import ConfigData
+import Utilities
+from WebFetch import WebFetch
+from HtmlStore import HtmlStore
+from SyntheticHtml import SyntheticHtml
+import Pgn as PgnModule
+from Pgn import Pgn, PgnState
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Benchmark-baseline.json")
+REGRESSION_LIMIT = 1.25  # a suite timing more than this much slower than the baseline is reported as a regression
+
+
+def getBenchmarkParams():
+    # benchmark name first, then the same style of flags as the main tool
+    params = {"benchmark": sys.argv[1].lower() if len(sys.argv) > 1 else "", "courses": [], "limit": 0,
+              "synthetic": 0, "save": False}
+    i = 1
+    inCourse = False
+    while i + 1 < len(sys.argv):
+        i += 1
+        thisArg = sys.argv[i].lower()
+        if inCourse and Utilities.is_integer(thisArg):
+            params["courses"].append(thisArg)
+            continue
+        inCourse = thisArg == "-courses"
+        if inCourse:
+            continue
+        if thisArg == "-htmlroot":
+            i = i + 1
+            ConfigData.HTML_CACHE_PATH = Utilities.getOpenOption(i, "html root location")
+            if ConfigData.HTML_CACHE_PATH is None:
+                return None
+            continue
+        if thisArg == "-cache":
+            i = i + 1
+            cache = Utilities.getOptionFromList(i, "html cache", WebFetch.cacheNames)
+            if cache is None:
+                return None
+            ConfigData.HTML_CACHE_BACKEND = WebFetch.cacheNames[cache]
+            continue
+        if thisArg == "-limit":
+            i = i + 1
+            params["limit"] = Utilities.getIntOption(i, "page limit")
+            if params["limit"] is None:
+                return None
+            continue
+        if thisArg == "-synthetic":
+            i = i + 1
+            params["synthetic"] = Utilities.getIntOption(i, "synthetic pages")
+            if params["synthetic"] is None:
+                return None
+            continue
+        if thisArg == "-save":
+            params["save"] = True
+            continue
+        print("- Don't know how to apply command line argument <" + thisArg + ">")
+    return params
+
+
+def findCachedVariations(courses, limit):
+    # (courseId, variationId, html) for cached variation pages, largest first - they're the interesting ones
+    if len(courses) == 0:
+        courses = sorted(set(location.split("/")[1] for location in
+                             WebFetch.listCachedLocations("course/") + listCourseFolders()))
+    locations = []
+    for courseId in courses:
+        locations += WebFetch.listCachedLocations("course/" + courseId + "/variation/")
+    locations.sort(key=WebFetch.getCachedSize, reverse=True)
+    if limit > 0:
+        locations = locations[:limit]
+    pages = []
+    for location in locations:
+        parts = location.split("/")
+        pages.append((parts[1], parts[3], WebFetch.loadHtmlFromFile(location)))
+    return pages
+
+
+def listCourseFolders():
+    # course ids that only have variations cached (like one-off) have a folder but no course page
+    if ConfigData.HTML_CACHE_BACKEND == "packed":
+        return ["course/" + key.split("/")[1] for key in HtmlStore.listKeys("course/") if key.count("/") > 1]
+    folder = ConfigData.HTML_CACHE_PATH + "course/"
+    return [] if not os.path.isdir(folder) else ["course/" + f for f in os.listdir(folder)
+                                                  if os.path.isdir(folder + f)]
+
+
+def renderQuietly(courseId, variationId, bs):
+    # the renderer reports what it fixes up - keep that out of the timings
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Pgn.createPgnFromHtml(courseId, variationId, bs, "1.1")
+
+
+def benchmarkParsers(pages):
+    parsers = [p for p in WebFetch.parserNames if WebFetch.isParserAvailable(p)]
+    print("- comparing " + ", ".join(parsers) + " on " + str(len(pages)) + " cached variations")
+    reference = None
+    results = []
+    for parser in parsers:
+        parseTime = 0.0
+        renderTime = 0.0
+        pgns = []
+        for courseId, variationId, pageHtml in pages:
+            start = time.perf_counter()
+            bs = WebFetch.parseHtml(pageHtml, parser)
+            parsed = time.perf_counter()
+            pgns.append(renderQuietly(courseId, variationId, bs))
+            renderTime += time.perf_counter() - parsed
+            parseTime += parsed - start
+        if reference is None:
+            reference = pgns
+        mismatches = sum(1 for a, b in zip(reference, pgns) if a != b)
+        results.append((parser, parseTime, renderTime, mismatches))
+
+    print(f"{'parser':<12} {'parse s':>9} {'render s':>9} {'total s':>9} {'ms/page':>8}  pgn vs {parsers[0]}")
+    for parser, parseTime, renderTime, mismatches in results:
+        perPage = 1000 * (parseTime + renderTime) / max(len(pages), 1)
+        same = "identical" if mismatches == 0 else str(mismatches) + " differ"
+        print(f"{parser:<12} {parseTime:>9.2f} {renderTime:>9.2f} {parseTime + renderTime:>9.2f} {perPage:>8.1f}  {same}")
+    identical = [r for r in results if r[3] == 0]
+    best = min(identical, key=lambda r: r[1] + r[2])
+    print("- fastest backend with identical pgn: " + best[0] + " (set HTML_PARSER in ConfigData.py or use -parser)")
+
+
+def benchmarkExtract(pages):
+    print("- whole page vs extracted parts on " + str(len(pages)) + " cached variations (" + ConfigData.HTML_PARSER + ")")
+    results = []
+    for label, prepare in [("whole page", lambda h: h), ("extracted", WebFetch.extractVariationParts)]:
+        parseTime = 0.0
+        peak = 0
+        pgns = []
+        for courseId, variationId, pageHtml in pages:
+            start = time.perf_counter()
+            bs = WebFetch.parseHtml(prepare(pageHtml))
+            parseTime += time.perf_counter() - start
+            pgns.append(renderQuietly(courseId, variationId, bs))
+        # memory is measured on a separate pass - tracing slows everything down
+        for courseId, variationId, pageHtml in pages:
+            tracemalloc.start()
+            bs = WebFetch.parseHtml(prepare(pageHtml))
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            del bs
+        results.append((label, parseTime, peak, pgns))
+
+    reference = results[0][3]
+    print(f"{'mode':<12} {'parse s':>9} {'ms/page':>8} {'peak MB':>8}  pgn vs whole page")
+    for label, parseTime, peak, pgns in results:
+        mismatches = sum(1 for a, b in zip(reference, pgns) if a != b)
+        same = "identical" if mismatches == 0 else str(mismatches) + " differ"
+        perPage = 1000 * parseTime / max(len(pages), 1)
+        print(f"{label:<12} {parseTime:>9.2f} {perPage:>8.1f} {peak / 1e6:>8.1f}  {same}")
+
+
+def getRawPgn(courseId, variationId, pageHtml):
+    # header and move text as buildMoveBody leaves it, before any of the chessbase workarounds
+    bs = WebFetch.parseHtml(WebFetch.extractVariationParts(pageHtml))
+    name, chapter, moves, term, inputFEN = WebFetch.getVariationParts(bs)
+    if chapter == []:
+        return None
+    with contextlib.redirect_stdout(io.StringIO()):
+        body = Pgn.buildMoveBody(moves, 0, PgnState(Pgn.PGN_WRITE_KEY_MOVE))
+    return Pgn.buildHeader(courseId, variationId, name, [li.text for li in chapter], "*", "1.1", inputFEN) + body
+
+
+def timeQuietly(function, *args):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function(*args)
+    return time.perf_counter() - start
+
+
+def benchmarkPostProcess(pages):
+    raws = [r for r in (getRawPgn(*page) for page in pages[:20]) if r is not None]
+    if len(raws) == 0:
+        print("- none of the cached variations could be parsed")
+        return
+    print("- chessbase workaround passes on the " + str(len(raws)) + " biggest cached games")
+    print(f"{'game size':>10} {'games':>6} {'KB':>8} {'root cmt':>9} {'last move':>9} {'escape':>9} {'all':>9} "
+          f"{'us/KB':>8}")
+    for repeat in [1, 8, 64]:
+        # repeating a game's moves makes a long, heavily annotated game with the same mix of comments and variations
+        games = [raw + raw[raw.index("\n\n") + 2:] * (repeat - 1) for raw in raws]
+        kb = sum(len(g) for g in games) / 1024
+        rootComment = sum(timeQuietly(PgnModule.findLastRootComment, g) for g in games)
+        lastMove = sum(timeQuietly(PgnModule.findLastMove, g) for g in games)
+        escape = 0.0
+        for g in games:
+            iComment, opens, closes = PgnModule.findLastRootComment(g)
+            escape += timeQuietly(PgnModule.escapeLastNumberInComments, g, opens, closes)
+        total = sum(timeQuietly(lambda x: PgnModule.re.sub(r' +', ' ', PgnModule.applyChessBaseWorkarounds(x)), g)
+                    for g in games)
+        print(f"{'x' + str(repeat):>10} {len(games):>6} {kb:>8.0f} {rootComment:>9.4f} {lastMove:>9.4f} {escape:>9.4f} "
+              f"{total:>9.4f} {1e6 * total / kb:>8.1f}")
+
+
+def getNestedMoves(pageHtml, levels):
+    # the game's moves, then the same moves again as a variation inside that, levels deep
+    bs = WebFetch.parseHtml(WebFetch.extractVariationParts(pageHtml))
+    moves = WebFetch.getVariationParts(bs)[2]
+    if moves is None:
+        return None
+    movesHtml = "".join(str(m) for m in moves)
+    nested = movesHtml
+    for level in range(levels - 1):
+        nested = movesHtml + '<span class="commentMove"><span class="commentSubvar">' + nested + '</span></span>'
+    return WebFetch.parseHtml("<div>" + nested + "</div>").div.find_all(recursive=False)
+
+
+def benchmarkMoveBody(pages):
+    pages = pages[:20]
+    print("- buildMoveBody on the " + str(len(pages)) + " biggest cached games")
+    print(f"{'nesting':>10} {'games':>6} {'KB out':>8} {'nodes':>8} {'s':>9} {'us/KB':>8}")
+    for levels in [1, 8, 64]:
+        trees = [t for t in (getNestedMoves(page[2], levels) for page in pages) if t is not None]
+        kb = 0.0
+        nodes = 0
+        elapsed = 0.0
+        for tree in trees:
+            state = PgnState(Pgn.PGN_WRITE_KEY_MOVE)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                body = Pgn.buildMoveBody(tree, 0, state)
+            elapsed += time.perf_counter() - start
+            kb += len(body) / 1024
+            nodes += state.count
+        print(f"{'x' + str(levels):>10} {len(trees):>6} {kb:>8.0f} {nodes:>8} {elapsed:>9.4f} "
+              f"{1e6 * elapsed / max(kb, 1):>8.1f}")
+
+
+def bestOf(rounds, function, *args):
+    # the quickest of a few runs - the others are mostly noise from whatever else the machine was doing
+    return min(timeQuietly(function, *args) for r in range(rounds))
+
+
+def renderAll(trees):
+    for courseId, variationId, bs in trees:
+        Pgn.createPgnFromHtml(courseId, variationId, bs, "1.1")
+
+
+def timeCacheHits(pages):
+    # getHtml for pages that are all in the cache - file (or store) read plus parse
+    savedPath, savedFetch = ConfigData.HTML_CACHE_PATH, WebFetch.doFetch
+    with tempfile.TemporaryDirectory() as htmlRoot:
+        ConfigData.HTML_CACHE_PATH = htmlRoot + "/"
+        WebFetch.doFetch = WebFetch.FETCH_NONE
+        try:
+            for courseId, variationId, pageHtml in pages:
+                WebFetch.writeHtmlToFile(WebFetch.getVariationLocation(variationId, courseId), pageHtml)
+            return bestOf(3, lambda: [WebFetch.getHtml("variation", variationId, "Default", "course/" + courseId,
+                                                       "variation") for courseId, variationId, h in pages])
+        finally:
+            HtmlStore.close()
+            ConfigData.HTML_CACHE_PATH, WebFetch.doFetch = savedPath, savedFetch
+
+
+def benchmarkSuite(pages, save=False):
+    print("- pgn engine suite on " + str(len(pages)) + " pages")
+    trees = [(courseId, variationId, WebFetch.parseHtml(pageHtml)) for courseId, variationId, pageHtml in pages]
+    with contextlib.redirect_stdout(io.StringIO()):
+        pgns = [Pgn.createPgnFromHtml(courseId, variationId, bs, "1.1") for courseId, variationId, bs in trees]
+    raws = [r for r in (getRawPgn(*page) for page in pages) if r is not None]
+    rawKb = sum(len(r) for r in raws) / 1024
+    comments = [PgnModule.findLastRootComment(r) for r in raws]
+
+    # per page or per KB of raw pgn, so runs with a different -synthetic / -limit are still comparable
+    results = {
+        "createPgnFromHtml us/page": 1e6 * bestOf(3, renderAll, trees) / len(trees),
+        "findLastMove us/KB": 1e6 * bestOf(3, lambda: [PgnModule.findLastMove(r) for r in raws]) / rawKb,
+        "escapeLastNumberInComments us/KB": 1e6 * bestOf(3, lambda: [
+            PgnModule.escapeLastNumberInComments(r, c[1], c[2]) for r, c in zip(raws, comments)]) / rawKb,
+        "getHtml cache hit (" + ConfigData.HTML_CACHE_BACKEND + ") us/page": 1e6 * timeCacheHits(pages) / len(pages),
+    }
+    pgnHash = hashlib.sha256("".join(p for p in pgns if p is not None).encode('utf-8')).hexdigest()
+
+    baseline = None
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, "r", encoding='utf-8') as file:
+            baseline = json.load(file)
+    regressions = 0
+    print(f"{'benchmark':<42} {'now':>10} {'baseline':>10} {'ratio':>7}")
+    for name, value in results.items():
+        before = None if baseline is None else baseline["timings"].get(name)
+        if before is None:
+            print(f"{name:<42} {value:>10.1f} {'-':>10}")
+            continue
+        ratio = value / before
+        slower = ratio > REGRESSION_LIMIT
+        regressions += slower
+        print(f"{name:<42} {value:>10.1f} {before:>10.1f} {ratio:>7.2f}" + ("  REGRESSION" if slower else ""))
+    if baseline is not None and baseline["pages"] == len(pages):
+        if baseline["pgnHash"] == pgnHash:
+            print("- pgn is identical to the baseline")
+        else:
+            print("- PGN CHANGED since the baseline - check the renderer (and bump RENDERER_VERSION if it's intended)")
+            regressions += 1
+    if save:
+        with open(BASELINE_FILE, "w", encoding='utf-8') as file:
+            json.dump({"pages": len(pages), "pgnHash": pgnHash, "timings": results}, file, indent=1)
+        print("- saved as the new baseline in " + BASELINE_FILE)
+    return regressions == 0
+
+
+def main():
+    benchmarks = {"parsers": benchmarkParsers, "extract": benchmarkExtract, "postprocess": benchmarkPostProcess,
+                  "movebody": benchmarkMoveBody, "suite": benchmarkSuite}
+    params = getBenchmarkParams()
+    if params is None:
+        return
+    if params["benchmark"] not in benchmarks:
+        print("- usage: python Benchmark.py <" + "|".join(benchmarks.keys()) + "> [-htmlroot <path>] "
+              "[-cache <files|packed>] [-courses <ids>] [-limit <n>] [-synthetic <n>] [-save]")
+        return
+    if params["benchmark"] == "suite":
+        # always synthetic, so the pgn can be checked against the baseline on any machine
+        pages = SyntheticHtml().makeCorpus(params["synthetic"] if params["synthetic"] > 0 else 200)
+        if not benchmarkSuite(pages, params["save"]):
+            sys.exit(1)
+        return
+    if params["synthetic"] > 0:
+        benchmarks[params["benchmark"]](SyntheticHtml().makeCorpus(params["synthetic"]))
+        return
+    pages = findCachedVariations(params["courses"], params["limit"])
+    if len(pages) == 0:
+        print("- no cached variations found under " + ConfigData.HTML_CACHE_PATH)
+        return
+    benchmarks[params["benchmark"]](pages)
+
+
+if __name__ == "__main__":
+    main()
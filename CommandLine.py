@@ -15,14 +15,32 @@ Contact: chess@demastri.com
 import sys
 import Utilities
 import ConfigData
+from OpeningBook import OpeningBook
+from PositionIndex import PositionIndex
 from WebFetch import WebFetch
+from WorkQueue import WorkQueue
 from Pgn import Pgn
 
 def processCommandLineParams():
     # there really just end up being three functional  parameters
-    # - web  - All (overwrite), None (Use Existing), Update (Use Existing, Get the Rest)
+    # - web  - All (overwrite), None (Use Existing), Update (Use Existing, Get the Rest),
+    #          Refresh (get course and chapter pages again, then only new variations)
     # - pgn  - No (don't generate), Incremental (after getting a variation, do Pgn), After (after getting all vars, do Pgn)
     # - key (default) / noKey -  controls if the first "key" position in the variation is marked in the pgn
+    # - extract (default) / noExtract - controls if only the parts of a variation page used for pgn are parsed
+    # - sidecar / noSidecar (default) - controls if those parts are saved next to the cached page for later runs
+    # - renderCache (default) / noRenderCache - controls if pgn rendered on earlier runs is reused
+    # - treeCache (default) / noTreeCache - controls if move trees built on earlier runs are reused
+    # - pipeline / noPipeline (default) - controls if variations are fetched ahead while earlier ones are rendered
+    # - timingLog (default) / noTimingLog - controls if each run's timing events are written to a log file
+    # - resume (default) / noResume - controls if an interrupted incremental course run continues where it stopped
+    # - rateLimit <n> - fetch no more than n pages a minute, across all workers
+    # - httpIndex / noHttpIndex (default) - controls if course and chapter pages are fetched over plain http
+    # - shard <i/n> - only work on this machine's share (i of n) of each course, writing a fragment for -merge
+    # - merge - put the shard fragments of each course back together into the course pgn
+    # - book <file> - write the cached courses and variations out as a polyglot opening book
+    # - positionIndex (default) / noPositionIndex - controls if rendered variations' positions are added to the index
+    # - findFen <fen> - list the indexed variations (of the given courses, or all) that reach a position
     # there are two arguments
     # - list of courses - get the course, get all chapters, then all variations for each course in course and course/variations
     # - list of variations - get the listed variations, and place in one-off/variations
@@ -32,6 +50,12 @@ def processCommandLineParams():
     # - set browser binary path
     # - set browser profile dir
     # - set browser profile name
+    # - set how many pages a browser session serves before it's restarted
+    # - set how many browsers fetch variations in parallel
+    # - set which variations those browsers fetch first
+    # - set how many processes render pgn from cached html
+    # - set the html parser backend
+    # - set the html cache backend, or migrate the html files into the packed cache
 
     # set defaults
     WebFetch.doFetch = WebFetch.FETCH_NEW
@@ -92,6 +116,77 @@ def processCommandLineParams():
             Pgn.PGN_WRITE_KEY_MOVE = False
             continue
 
+        if thisArg == "-extract":
+            ConfigData.VARIATION_EXTRACT = True
+            continue
+
+        if thisArg == "-noextract":
+            ConfigData.VARIATION_EXTRACT = False
+            continue
+
+        if thisArg == "-sidecar":
+            ConfigData.VARIATION_SIDECAR = True
+            continue
+
+        if thisArg == "-nosidecar":
+            ConfigData.VARIATION_SIDECAR = False
+            continue
+
+        if thisArg == "-rendercache":
+            ConfigData.RENDER_CACHE = True
+            continue
+
+        if thisArg == "-norendercache":
+            ConfigData.RENDER_CACHE = False
+            continue
+
+        if thisArg == "-treecache":
+            ConfigData.TREE_CACHE = True
+            continue
+
+        if thisArg == "-notreecache":
+            ConfigData.TREE_CACHE = False
+            continue
+
+        if thisArg == "-pipeline":
+            ConfigData.FETCH_PIPELINE = True
+            continue
+
+        if thisArg == "-nopipeline":
+            ConfigData.FETCH_PIPELINE = False
+            continue
+
+        if thisArg == "-timinglog":
+            ConfigData.TIMING_LOG = True
+            continue
+
+        if thisArg == "-notiminglog":
+            ConfigData.TIMING_LOG = False
+            continue
+
+        if thisArg == "-resume":
+            ConfigData.RESUME_RUNS = True
+            continue
+
+        if thisArg == "-noresume":
+            ConfigData.RESUME_RUNS = False
+            continue
+
+        if thisArg == "-httpindex":
+            ConfigData.FETCH_BACKENDS = dict(ConfigData.FETCH_BACKENDS, course="http", chapter="http")
+            continue
+
+        if thisArg == "-nohttpindex":
+            ConfigData.FETCH_BACKENDS = dict(ConfigData.FETCH_BACKENDS, course="selenium", chapter="selenium")
+            continue
+
+        if thisArg == "-ratelimit":
+            i = i + 1  # the value of this parameter is the next arg
+            ConfigData.FETCH_RATE_LIMIT = Utilities.getIntOption(i, "pages fetched per minute")
+            if ConfigData.FETCH_RATE_LIMIT is None:
+                return None, None, None
+            continue
+
         if thisArg == "-pgn":
             i = i + 1  # the value of this parameter is the next arg
             Pgn.doPgn = Utilities.getOptionFromList(i, "pgn mode", Pgn.flagNames)
@@ -135,8 +230,111 @@ def processCommandLineParams():
                 return None, None, None
             continue
 
+        if thisArg == "-recycle":
+            i = i + 1  # the value of this parameter is the next arg
+            ConfigData.BROWSER_RECYCLE_PAGES = Utilities.getIntOption(i, "pages per browser session")
+            if ConfigData.BROWSER_RECYCLE_PAGES is None:
+                return None, None, None
+            continue
+
+        if thisArg == "-workers":
+            i = i + 1  # the value of this parameter is the next arg
+            ConfigData.FETCH_WORKERS = Utilities.getIntOption(i, "parallel fetch workers")
+            if ConfigData.FETCH_WORKERS is None:
+                return None, None, None
+            continue
+
+        if thisArg == "-schedule":
+            i = i + 1  # the value of this parameter is the next arg
+            order = Utilities.getOptionFromList(i, "fetch schedule", WorkQueue.orderNames)
+            if order is None:
+                return None, None, None
+            ConfigData.SCHEDULE_ORDER = WorkQueue.orderNames[order]
+            continue
+
+        if thisArg == "-renderworkers":
+            i = i + 1  # the value of this parameter is the next arg
+            ConfigData.RENDER_WORKERS = Utilities.getIntOption(i, "pgn render processes")
+            if ConfigData.RENDER_WORKERS is None:
+                return None, None, None
+            continue
+
+        if thisArg == "-parser":
+            i = i + 1  # the value of this parameter is the next arg
+            parser = Utilities.getOptionFromList(i, "html parser", WebFetch.parserNames)
+            if parser is None:
+                return None, None, None
+            ConfigData.HTML_PARSER = WebFetch.parserNames[parser]
+            if not WebFetch.isParserAvailable(ConfigData.HTML_PARSER):
+                print("- html parser <" + ConfigData.HTML_PARSER + "> is not installed.  Exiting.")
+                return None, None, None
+            continue
+
+        if thisArg == "-cache":
+            i = i + 1  # the value of this parameter is the next arg
+            cache = Utilities.getOptionFromList(i, "html cache", WebFetch.cacheNames)
+            if cache is None:
+                return None, None, None
+            ConfigData.HTML_CACHE_BACKEND = WebFetch.cacheNames[cache]
+            continue
+
+        if thisArg == "-migratecache":
+            processMode = "migrate"
+            continue
+
+        if thisArg == "-shard":
+            i = i + 1  # the value of this parameter is the next arg
+            shard = Utilities.getOpenOption(i, "shard")
+            if shard is None:
+                return None, None, None
+            parts = shard.split("/")
+            if len(parts) != 2 or not all(p.isdigit() for p in parts) or not 1 <= int(parts[0]) <= int(parts[1]):
+                print("- Invalid argument <" + shard + "> provided for shard (expected i/n, like 2/3).  Exiting.")
+                return None, None, None
+            ConfigData.SHARD_INDEX = int(parts[0])
+            ConfigData.SHARD_COUNT = int(parts[1])
+            continue
+
+        if thisArg == "-merge":
+            processMode = "merge"
+            continue
+
+        if thisArg == "-book":
+            i = i + 1  # the value of this parameter is the next arg
+            ConfigData.BOOK_FILE = Utilities.getOpenOption(i, "opening book file")
+            if ConfigData.BOOK_FILE is None:
+                return None, None, None
+            if not OpeningBook.isAvailable():
+                print("- python-chess is needed to write an opening book (pip install chess).  Exiting.")
+                return None, None, None
+            processMode = "book"
+            continue
+
+        if thisArg == "-positionindex":
+            ConfigData.POSITION_INDEX = True
+            continue
+
+        if thisArg == "-nopositionindex":
+            ConfigData.POSITION_INDEX = False
+            continue
+
+        if thisArg == "-findfen":
+            i = i + 1  # the value of this parameter is the next arg
+            PositionIndex.findFen = Utilities.getOpenOption(i, "position to find")
+            if PositionIndex.findFen is None:
+                return None, None, None
+            processMode = "findfen"
+            continue
+
         print("- Don't know how to apply command line argument <" + thisArg + ">")
 
+    # a variation page only has its moves once the browser has run its scripts and the back button has been clicked,
+    # so no other backend can fetch one
+    if ConfigData.FETCH_BACKENDS.get("variation", "selenium") != "selenium":
+        print("- variation pages can only be fetched with the browser - using selenium for them instead of " +
+              str(ConfigData.FETCH_BACKENDS["variation"]))
+        ConfigData.FETCH_BACKENDS = dict(ConfigData.FETCH_BACKENDS, variation="selenium")
+
     return processMode, courses, variations
 
 def getNextItemToProcess():
@@ -160,10 +358,11 @@ def getNextItemToProcess():
 
     s = "-1"
     while not Utilities.is_integer(s) or int(s) not in range(len(WebFetch.flagNames)):
-        s = input( "--- HTML - Fetch New HTML (1-default), refetch All HTML (2), use existing HTML (3), or quit (q)? ")
+        s = input( "--- HTML - Fetch New HTML (1-default), refetch All HTML (2), use existing HTML (3), "
+                   "refresh course and get new variations (4), or quit (q)? ")
         if s == "q":
             return True, None, None
-        # real range of values is 0-2, so have to use s-1
+        # real range of values is 0-3, so have to use s-1
         WebFetch.doFetch = WebFetch.FETCH_NEW if s == "-1" or not Utilities.is_integer(s) else int(s)-1
         s = str(WebFetch.doFetch)
     print( "-- Web fetch mode set to "+WebFetch.flagNames[WebFetch.doFetch])
@@ -17,3 +17,39 @@ TESTING_PROFILE_BASE_DIR = "C:/Users/john/AppData/Local/Google/Chrome for Testin
 TESTING_PROFILE = "Default"
 HTML_CACHE_PATH = './html/'
 PGN_CACHE_PATH = './pgn/'
+BROWSER_RECYCLE_PAGES = 100  # restart the browser session after this many page loads
+FETCH_WORKERS = 1  # browsers fetching variations in parallel, each with its own copy of the testing profile
+PAGE_READY_TIMEOUTS = {"course": 20, "chapter": 20, "variation": 30}  # max seconds to wait for each page type's content
+BACK_BUTTON_TIMEOUT = 5  # max seconds for a variation's back button to switch off after it's clicked
+RENDER_WORKERS = 1  # processes rendering pgn from cached html
+HTML_PARSER = 'html.parser'  # bs4 backend for cached pages - 'lxml' is faster if it's installed
+VARIATION_EXTRACT = True  # only parse the parts of a variation page that pgn is built from
+VARIATION_SIDECAR = False  # save those parts next to the cached page (<id>.parts.html) so later runs skip the full page
+HTML_CACHE_BACKEND = 'files'  # 'files' - one .html file per page, or 'packed' - compressed pages in one indexed file
+HTML_STORE_FILE = 'cache.sqlite'  # name of the packed store, under HTML_CACHE_PATH
+HTML_STORE_LEVEL = 6  # zlib compression level for the packed store
+RENDER_CACHE = True  # reuse pgn rendered on earlier runs when the variation html and pgn options haven't changed
+TREE_CACHE = True  # keep each variation's parsed move tree in the render cache folder, so re-renders skip the html parse
+RENDER_CACHE_MAX_MB = 500  # least recently used render cache entries are removed past this size
+FETCH_PIPELINE = False  # fetch variations on a separate thread, ahead of the variation being rendered
+PIPELINE_DEPTH = 20  # how many fetched variations can be waiting to be rendered
+TIMING_LOG = True  # write each run's timing events to a json lines file
+TIMING_LOG_PATH = './log/'  # where those files go
+RESUME_RUNS = True  # an incremental course run that was interrupted continues from its last written variation
+FETCH_ATTEMPTS = 3  # times a page is tried before it's queued to be retried at the end of the run
+FETCH_BACKOFF_BASE = 2  # seconds before the first retry of a page - doubled (with jitter) for each retry after that
+FETCH_BACKOFF_MAX = 60  # longest wait between retries of a page, in seconds
+FETCH_RATE_LIMIT = 0  # most pages requested per minute, across all fetch workers - 0 for no limit
+BREAKER_THRESHOLD = 5  # failed fetches in a row that pause all fetching
+BREAKER_PAUSE = 120  # seconds fetching is paused for when that happens
+# how each page type is fetched - 'selenium' (the browser) or 'http' (plain requests with the browser profile's session,
+# falling back to the browser when the page doesn't have its content without scripts running).  Variation pages are
+# always fetched with the browser
+FETCH_BACKENDS = {"course": "selenium", "chapter": "selenium", "variation": "selenium"}
+SHARD_INDEX = 1  # which share of each course this machine works on, from 1 to SHARD_COUNT
+SHARD_COUNT = 1  # how many machines a run is split across - 1 for no split
+POSITION_INDEX = True  # keep an index of every position in the rendered variations, for -findFen
+POSITION_INDEX_FILE = 'positions.sqlite'  # name of that index, under PGN_CACHE_PATH
+BOOK_FILE = './pgn/book.bin'  # where -book writes the polyglot opening book
+BOOK_KEY_WEIGHT = 4  # a course's key move counts this many times towards its weight in the book
+SCHEDULE_ORDER = 'given'  # with fetch workers, which variations are fetched first - 'given', 'oneoffs' or 'smallest'
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Filename: CourseManifest.py
+Author: John DeMastri
+Create Date: 2025-05-14
+Version: 0.1
+Description: Keeps the structure of a course - its name, chapters in order, and each chapter's variation ids and
+names in order - in a small json manifest next to the course html (course/<courseID>.manifest.json).
+Building it means parsing the course page and every chapter page.  Once it exists, runs that don't refetch those
+pages read the manifest instead.  The manifest records a hash of each course and chapter page it was built from, and
+is rebuilt as soon as any of them changes (or goes missing).
+
+License: MIT License
+Contact: chess@demastri.com
+"""
+import hashlib
+import json
+
+from Timing import Timing
+from WebFetch import WebFetch
+
+MANIFEST_SUFFIX = ".manifest.json"
+MANIFEST_VERSION = 1
+
+
+class CourseManifest:
+
+    @classmethod
+    def getManifest(cls, courseId: str, profileName: str):
+        manifest = CourseManifest.loadManifest(courseId)
+        if manifest is not None:
+            print("----- using manifest for course " + courseId)
+            Timing.count("manifest used")
+            return manifest
+        Timing.count("manifest built")
+        return CourseManifest.buildManifest(courseId, profileName)
+
+    @classmethod
+    def loadManifest(cls, courseId: str):
+        # a manifest is only good if none of the pages it came from would be fetched again
+        if WebFetch.isRefetch(CourseManifest.getLocation(courseId), "course"):
+            return None
+        text = WebFetch.loadHtmlFromFile(CourseManifest.getLocation(courseId), MANIFEST_SUFFIX)
+        if len(text) == 0:
+            return None
+        try:
+            manifest = json.loads(text)
+        except ValueError:
+            return None
+        if manifest.get("version") != MANIFEST_VERSION:
+            return None
+        for location, sourceHash in manifest["sources"].items():
+            if CourseManifest.hashSource(WebFetch.loadHtmlFromFile(location)) != sourceHash:
+                print("----- course " + courseId + " html has changed since its manifest was built")
+                return None
+        return manifest
+
+    @classmethod
+    def buildManifest(cls, courseId: str, profileName: str):
+        courseBS, chapterTags = WebFetch.getCourseDetail(courseId, profileName)
+        manifest = {"version": MANIFEST_VERSION, "courseId": courseId, "name": WebFetch.getCourseName(courseBS),
+                    "sources": {}, "chapters": []}
+        if courseBS is None:
+            return manifest
+        complete = True
+        manifest["sources"][WebFetch.getLocation("course", courseId)] = None
+
+        for chapterTag in chapterTags:
+            chapter = CourseManifest.processChapter(courseId, chapterTag, profileName)
+            if chapter is None:
+                # keep its place, so the Round of every later chapter stays the same.  It isn't a source, and the
+                # manifest isn't saved
+                complete = False
+                manifest["chapters"].append({"id": WebFetch.getChapterIdFromTag(chapterTag),
+                                             "name": WebFetch.getChapterName(chapterTag), "variations": []})
+                continue
+            manifest["chapters"].append(chapter)
+            manifest["sources"][WebFetch.getLocation("course", courseId + "/" + chapter["id"])] = None
+
+        # only keep a manifest that describes the whole course
+        if complete:
+            for location in manifest["sources"]:
+                manifest["sources"][location] = CourseManifest.hashSource(WebFetch.loadHtmlFromFile(location))
+            WebFetch.writeHtmlToFile(CourseManifest.getLocation(courseId), json.dumps(manifest, indent=1),
+                                     MANIFEST_SUFFIX)
+        return manifest
+
+    @classmethod
+    def processChapter(cls, courseId, chapterTag, profileName):
+        name = WebFetch.getChapterName(chapterTag)
+        print("Parsing '" + name + "' (" + profileName + ") ")
+        chapterBS, variationTags = WebFetch.getChapterDetail(courseId, chapterTag, profileName)
+        print(" returned  '" + name + "' had (" + profileName + ") " + str(len(variationTags)) + " variations")
+        if chapterBS is None:
+            return None
+        return {"id": WebFetch.getChapterIdFromTag(chapterTag), "name": name,
+                "variations": [{"id": WebFetch.getVariationIdFromTag(v), "name": WebFetch.getVariationNameFromTag(v)}
+                               for v in variationTags]}
+
+    @classmethod
+    def getLocation(cls, courseId: str):
+        return WebFetch.getLocation("course", courseId)
+
+    @classmethod
+    def hashSource(cls, pageHtml):
+        return hashlib.sha1(pageHtml.encode('utf-8')).hexdigest()
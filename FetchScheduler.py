@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Filename: FetchScheduler.py
+Author: John DeMastri
+Create Date: 2025-05-21
+Version: 0.1
+Description: Decides when the next page can be fetched from the web, so a slow or failing server is backed off from
+instead of hammered.
+- Rate limit: pages are spaced out so no more than FETCH_RATE_LIMIT are requested per minute, across every fetch
+worker.  The schedule lives in shared memory that fetch worker processes are handed when they start.
+- Backoff: a failed page is retried after a delay that doubles with every attempt (FETCH_BACKOFF_BASE up to
+FETCH_BACKOFF_MAX seconds), with random jitter so workers don't retry in step.
+- Circuit breaker: after BREAKER_THRESHOLD failed attempts in a row (by anyone), every fetch waits BREAKER_PAUSE
+seconds.  The next attempt after the pause trips it again straight away if it fails too.
+- Retry queue: pages that still fail after all their attempts are queued and tried once more at the end of the run.
+
+License: MIT License
+Contact: chess@demastri.com
+"""
+import multiprocessing
+import random
+import threading
+import time
+
+import ConfigData
+from Timing import Timing
+
+# slots in the shared schedule
+NEXT_REQUEST = 0  # time.time() the next page can be requested under the rate limit
+PAUSED_UNTIL = 1  # time.time() an open circuit breaker lets fetches through again
+FAILURES = 2  # failed attempts in a row
+
+# guards creating the shared schedule - fetchAhead's thread and the main thread can both get there first
+sharedStateLock = threading.Lock()
+
+
+class FetchScheduler:
+    sharedState = None  # created by the main process on first use, handed to fetch workers by WorkerPool
+
+    # (location, url, pageType) of pages that failed every attempt this run, in the order they failed
+    retryQueue = []
+    # pages that failed again at the end of the run - not tried any more
+    gaveUp = set()
+
+    @classmethod
+    def getSharedState(cls):
+        if FetchScheduler.sharedState is None:
+            with sharedStateLock:
+                if FetchScheduler.sharedState is None:
+                    FetchScheduler.sharedState = multiprocessing.Array('d', 3)
+        return FetchScheduler.sharedState
+
+    @classmethod
+    def useSharedState(cls, state):
+        FetchScheduler.sharedState = state
+
+    @classmethod
+    def startRun(cls):
+        # a batch in interactive mode is a run of its own - pages given up on by an earlier one are tried again
+        FetchScheduler.retryQueue = []
+        FetchScheduler.gaveUp = set()
+
+    @classmethod
+    def waitForTurn(cls):
+        # blocks until this process (or thread) may request a page
+        state = FetchScheduler.getSharedState()
+        with state.get_lock():
+            now = time.time()
+            start = max(now, state[PAUSED_UNTIL])
+            if ConfigData.FETCH_RATE_LIMIT > 0:
+                start = max(start, state[NEXT_REQUEST])
+                state[NEXT_REQUEST] = start + 60.0 / ConfigData.FETCH_RATE_LIMIT
+        if start > now:
+            with Timing.stage("fetch wait"):
+                time.sleep(start - now)
+
+    @classmethod
+    def recordResult(cls, succeeded):
+        state = FetchScheduler.getSharedState()
+        with state.get_lock():
+            if succeeded:
+                state[FAILURES] = 0
+                return
+            state[FAILURES] += 1
+            if state[FAILURES] < ConfigData.BREAKER_THRESHOLD:
+                return
+            # half open once the pause is over - one more failure trips it again
+            state[FAILURES] = ConfigData.BREAKER_THRESHOLD - 1
+            state[PAUSED_UNTIL] = time.time() + ConfigData.BREAKER_PAUSE
+        print("--- " + str(ConfigData.BREAKER_THRESHOLD) + " fetches failed in a row - pausing fetches for " +
+              str(ConfigData.BREAKER_PAUSE) + "s")
+        Timing.count("breaker opened")
+
+    @classmethod
+    def getBackoff(cls, attempt):
+        # seconds to wait before retry number attempt (1 is the first retry) - somewhere in the upper half of the
+        # doubled delay, so it still grows but workers that failed together spread out
+        delay = min(ConfigData.FETCH_BACKOFF_MAX, ConfigData.FETCH_BACKOFF_BASE * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    @classmethod
+    def backOff(cls, attempt):
+        delay = FetchScheduler.getBackoff(attempt)
+        print(f"-- waiting {delay:.1f}s before trying again")
+        with Timing.stage("fetch backoff"):
+            time.sleep(delay)
+
+    @classmethod
+    def queueRetry(cls, location, url, pageType):
+        if location in FetchScheduler.gaveUp:
+            return
+        if all(location != queued[0] for queued in FetchScheduler.retryQueue):
+            FetchScheduler.retryQueue.append((location, url, pageType))
+
+    @classmethod
+    def takeRetries(cls):
+        # the queued pages, leaving the queue empty
+        retries = FetchScheduler.retryQueue
+        FetchScheduler.retryQueue = []
+        return retries
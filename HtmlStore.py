@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Filename: HtmlStore.py
+Author: John DeMastri
+Create Date: 2025-05-13
+Version: 0.1
+Description: Packed html cache.  Instead of one .html file per page under HTML_CACHE_PATH, pages are zlib compressed
+and kept in a single sqlite file, keyed by the same location strings WebFetch uses for file names
+(like "course/24575/variation/38877075.html").  Lookups, existence checks and per-course listings are index queries
+rather than file system calls.  migrateFromFiles() copies an existing directory cache into the store.
+
+License: MIT License
+Contact: chess@demastri.com
+"""
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import ConfigData
+
+
+class HtmlStore:
+    # each thread gets its own connection - sqlite connections can't be shared between threads
+    threadState = threading.local()
+
+    @classmethod
+    def getStoreFileName(cls):
+        return ConfigData.HTML_CACHE_PATH + ConfigData.HTML_STORE_FILE
+
+    @classmethod
+    def getConnection(cls):
+        # one connection per process (and thread) - a connection inherited from a parent process can't be used safely
+        storeFile = HtmlStore.getStoreFileName()
+        state = HtmlStore.threadState
+        if getattr(state, "connection", None) is None or state.pid != os.getpid() or state.file != storeFile:
+            os.makedirs(ConfigData.HTML_CACHE_PATH, exist_ok=True)
+            state.connection = sqlite3.connect(storeFile, timeout=60, isolation_level=None)
+            state.connection.execute("PRAGMA journal_mode=WAL")
+            state.connection.execute("CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, stored REAL, "
+                                     "size INTEGER, data BLOB)")
+            state.pid = os.getpid()
+            state.file = storeFile
+        return state.connection
+
+    @classmethod
+    def close(cls):
+        state = HtmlStore.threadState
+        if getattr(state, "connection", None) is not None and state.pid == os.getpid():
+            state.connection.close()
+        state.connection = None
+
+    @classmethod
+    def exists(cls, key):
+        row = HtmlStore.getConnection().execute("SELECT size FROM pages WHERE key = ?", (key,)).fetchone()
+        return row is not None and row[0] > 0
+
+    @classmethod
+    def read(cls, key):
+        row = HtmlStore.getConnection().execute("SELECT data FROM pages WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return ""
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    @classmethod
+    def write(cls, key, content, stored=None):
+        data = content.encode('utf-8')
+        HtmlStore.getConnection().execute(
+            "INSERT OR REPLACE INTO pages (key, stored, size, data) VALUES (?, ?, ?, ?)",
+            (key, time.time() if stored is None else stored, len(data), zlib.compress(data, ConfigData.HTML_STORE_LEVEL)))
+
+    @classmethod
+    def getStoredTime(cls, key):
+        row = HtmlStore.getConnection().execute("SELECT stored FROM pages WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    @classmethod
+    def getSize(cls, key):
+        row = HtmlStore.getConnection().execute("SELECT size FROM pages WHERE key = ?", (key,)).fetchone()
+        return 0 if row is None else row[0]
+
+    @classmethod
+    def listKeys(cls, prefix):
+        # every key starting with prefix, in key order - the primary key index makes this a range scan
+        rows = HtmlStore.getConnection().execute(
+            "SELECT key FROM pages WHERE key >= ? AND key < ? ORDER BY key", (prefix, prefix + "\uffff"))
+        return [row[0] for row in rows]
+
+    @classmethod
+    def getTotals(cls):
+        row = HtmlStore.getConnection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(data)), 0) FROM pages").fetchone()
+        return row[0], row[1], row[2]
+
+    @classmethod
+    def migrateFromFiles(cls, htmlRoot):
+        # copy every cached .html file under htmlRoot into the store.  Files are left in place - delete them once
+        # you're happy with the packed cache
+        print("--- migrating html files under " + htmlRoot + " into " + HtmlStore.getStoreFileName() + " ---")
+        connection = HtmlStore.getConnection()
+        migrated = 0
+        fileBytes = 0
+        connection.execute("BEGIN")
+        for dirPath, dirNames, fileNames in os.walk(htmlRoot):
+            for fileName in fileNames:
+                if not fileName.endswith(".html"):
+                    continue
+                fullName = os.path.join(dirPath, fileName)
+                key = os.path.relpath(fullName, htmlRoot).replace("\\", "/")
+                with open(fullName, "r", encoding='utf-8') as file:
+                    HtmlStore.write(key, file.read(), os.path.getmtime(fullName))
+                fileBytes += os.path.getsize(fullName)
+                migrated += 1
+                if migrated % 1000 == 0:
+                    connection.execute("COMMIT")
+                    print("- migrated " + str(migrated) + " pages")
+                    connection.execute("BEGIN")
+        connection.execute("COMMIT")
+        pages, size, packed = HtmlStore.getTotals()
+        print("- migrated " + str(migrated) + " pages (" + str(fileBytes // 1024) + " KB on disk)")
+        print("- store now holds " + str(pages) + " pages, " + str(size // 1024) + " KB of html packed into " +
+              str(packed // 1024) + " KB")
+        return migrated
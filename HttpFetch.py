@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Filename: HttpFetch.py
+Author: John DeMastri
+Create Date: 2025-05-22
+Version: 0.1
+Description: Plain http fetching for pages that don't need a browser to run their scripts.  A pooled urllib3 client
+keeps connections to the site open across pages, and sends the session cookies (and user agent) of the logged in
+browser profile, so the site sees the same session it would from Chrome.  WebFetch decides which page types are
+fetched this way (FETCH_BACKENDS in ConfigData) and checks each page has the content it expects, falling back to the
+browser when it doesn't.
+
+License: MIT License
+Contact: chess@demastri.com
+"""
+from urllib.parse import urlsplit
+
+import urllib3
+
+
+class HttpFetch:
+    pool = None
+    # set from the browser session the first time a profile is used - cookies are only sent to hosts they belong to
+    cookies = None
+    cookieProfile = None
+    userAgent = None
+
+    @classmethod
+    def getPool(cls):
+        if HttpFetch.pool is None:
+            HttpFetch.pool = urllib3.PoolManager(num_pools=4, maxsize=4, retries=False,
+                                                 timeout=urllib3.Timeout(connect=10, read=30))
+        return HttpFetch.pool
+
+    @classmethod
+    def hasSession(cls, profileName):
+        return HttpFetch.cookies is not None and HttpFetch.cookieProfile == profileName
+
+    @classmethod
+    def setSession(cls, profileName, cookies, userAgent=None):
+        # cookies are webdriver cookie dicts (name, value, domain, ...)
+        HttpFetch.cookies = cookies
+        HttpFetch.cookieProfile = profileName
+        HttpFetch.userAgent = userAgent
+
+    @classmethod
+    def clearSession(cls):
+        HttpFetch.cookies = None
+        HttpFetch.cookieProfile = None
+        HttpFetch.userAgent = None
+
+    @classmethod
+    def getCookieHeader(cls, url):
+        host = urlsplit(url).hostname or ""
+        pairs = []
+        for cookie in HttpFetch.cookies or []:
+            domain = cookie.get("domain", host).lstrip(".")
+            if host == domain or host.endswith("." + domain):
+                pairs.append(cookie["name"] + "=" + cookie["value"])
+        return "; ".join(pairs)
+
+    @classmethod
+    def get(cls, url):
+        # returns (status, page text).  Connection errors are raised
+        headers = {"Accept": "text/html"}
+        cookieHeader = HttpFetch.getCookieHeader(url)
+        if cookieHeader != "":
+            headers["Cookie"] = cookieHeader
+        if HttpFetch.userAgent is not None:
+            headers["User-Agent"] = HttpFetch.userAgent
+        response = HttpFetch.getPool().request("GET", url, headers=headers, redirect=True)
+        contentType = response.headers.get("Content-Type", "")
+        charset = contentType.split("charset=")[-1].split(";")[0].strip() if "charset=" in contentType else 'utf-8'
+        return response.status, response.data.decode(charset, errors='replace')
+
+    @classmethod
+    def close(cls):
+        if HttpFetch.pool is not None:
+            HttpFetch.pool.clear()
+            HttpFetch.pool = None
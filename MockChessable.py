@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Filename: MockChessable.py
+Author: John DeMastri
+Create Date: 2025-05-18
+Version: 0.1
+Description: A local stand-in for chessable.com, so the fetch side of the tool can be measured without a login.
+MockChessableServer serves made up course, chapter and variation pages (variations come from SyntheticHtml) at the
+same urls WebFetch builds from BASE_CHESSABLE_URL, with a configurable delay per page, a share of failed pages and a
+share of variations that open with the back button still on.  FakeDriver is just enough of a selenium webdriver to read
+those pages - setting WebFetch.driverFactory = FakeDriver makes the tool use it instead of Chrome.
+Run as a script it starts a server, runs the tool's processBatch against it and reports pages per second:
+    python MockChessable.py [-courses <n>] [-chapters <n>] [-variations <n>] [-latency <ms>] [-failrate <pct>]
+                            [-backon <pct>] [-timeout <s>] [-workers <n>] [-pipeline] [-pgn <none|incremental|after>]
+                            [-ratelimit <pages/min>] [-httpindex] [-refetchcheck] [-verbose]
+  -courses, -chapters and -variations set the size of the library (courses, chapters per course, variations per chapter)
+  -failrate is the percentage of pages served as an error, -backon the percentage of variations that need the back
+  button clicked, -timeout how long the tool waits for a page's content (so failures don't take the real 20-30s)
+  -refetchcheck runs the library twice - once to cache it, then with -web all while every course and chapter page
+  fails - and checks the second run still writes every cached variation, from the cached course and chapter pages
+
+License: MIT License
+Contact: chess@demastri.com
+"""
+import contextlib
+import importlib.util
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from bs4 import BeautifulSoup
+from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.common.by import By
+
+import ConfigData
+import Utilities
+import Pgn as PgnModule
+from Pgn import Pgn
+from SyntheticHtml import SyntheticHtml
+from WebFetch import WebFetch
+
+
+class MockChessableServer:
+    # what the handler serves - set before start()
+    chapters = 5
+    variations = 20
+    latency = 0.0  # seconds before each page is sent
+    failRate = 0.0  # share of pages answered with an error page instead
+    failPageTypes = set()  # page types that are always answered with an error page
+    backOnRate = 0.0  # share of variation pages whose back button starts on
+    synthetic = SyntheticHtml()
+
+    # what was served, by page type - pages a fetch worker gets from another process count here too
+    served = {}
+    failed = 0
+    withSession = 0  # requests that came with FakeDriver's session cookie, as the http backend should send it
+    lock = threading.Lock()
+
+    server = None
+
+    @classmethod
+    def start(cls):
+        # serves on a free local port, on a background thread.  Returns the base url to use for BASE_CHESSABLE_URL
+        MockChessableServer.server = ThreadingHTTPServer(("127.0.0.1", 0), MockChessableHandler)
+        MockChessableServer.server.daemon_threads = True
+        threading.Thread(target=MockChessableServer.server.serve_forever, daemon=True).start()
+        return "http://127.0.0.1:" + str(MockChessableServer.server.server_address[1]) + "/"
+
+    @classmethod
+    def stop(cls):
+        if MockChessableServer.server is not None:
+            MockChessableServer.server.shutdown()
+            MockChessableServer.server.server_close()
+            MockChessableServer.server = None
+
+    @classmethod
+    def count(cls, pageType, failed, withSession=False):
+        with MockChessableServer.lock:
+            if withSession:
+                MockChessableServer.withSession += 1
+            if failed:
+                MockChessableServer.failed += 1
+            else:
+                MockChessableServer.served[pageType] = MockChessableServer.served.get(pageType, 0) + 1
+
+    @classmethod
+    def getPage(cls, path):
+        # (pageType, html) for a url path, or (None, None) if it isn't one the tool asks for
+        parts = path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "course" and parts[1].isdigit():
+            return "course", MockChessableServer.getCoursePage(int(parts[1]))
+        if len(parts) == 3 and parts[0] == "course" and parts[1].isdigit() and parts[2].isdigit():
+            return "chapter", MockChessableServer.getChapterPage(int(parts[1]), int(parts[2]))
+        if len(parts) == 2 and parts[0] == "variation" and parts[1].isdigit():
+            return "variation", MockChessableServer.getVariationPage(int(parts[1]))
+        return None, None
+
+    @classmethod
+    def getCoursePage(cls, courseId):
+        chapters = "".join('<div class="chapter"><a href="/course/%d/%d">Open</a>'
+                           '<div class="toBeClamped title">Chapter %d</div></div>' % (courseId, c, c)
+                           for c in range(1, MockChessableServer.chapters + 1))
+        return '<html><head><title>Mock Course %d - Chessable</title></head><body>%s</body></html>' % (
+            courseId, chapters)
+
+    @classmethod
+    def getChapterPage(cls, courseId, chapterId):
+        cards = "".join('<div class="variation-card__row--main"><a href="/variation/%d/">Variation %d</a></div>' %
+                        (variationId, variationId) for variationId in
+                        MockChessableServer.getVariationIds(courseId, chapterId))
+        return '<html><head><title>Chapter %d - Chessable</title></head><body>%s</body></html>' % (chapterId, cards)
+
+    @classmethod
+    def getVariationIds(cls, courseId, chapterId):
+        first = (courseId * 1000 + chapterId) * 1000
+        return range(first + 1, first + MockChessableServer.variations + 1)
+
+    @classmethod
+    def getVariationPage(cls, variationId):
+        pageHtml = MockChessableServer.synthetic.makePage(variationId)
+        backClass = "myButton" if random.random() < MockChessableServer.backOnRate else "myButton myButtonOff"
+        controls = '<div id="controls"><button class="myButton">Start</button><button class="%s">Back</button></div>' % (
+            backClass)
+        return pageHtml.replace("</body>", controls + "</body>")
+
+
+class MockChessableHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(MockChessableServer.latency)
+        pageType, pageHtml = MockChessableServer.getPage(self.path)
+        failed = pageHtml is None or pageType in MockChessableServer.failPageTypes or \
+            random.random() < MockChessableServer.failRate
+        MockChessableServer.count(pageType, failed, "mockSession=fake" in (self.headers.get("Cookie") or ""))
+        if failed:
+            self.send_response(503 if pageHtml is not None else 404)
+            pageHtml = "<html><body>Something went wrong</body></html>"
+        else:
+            self.send_response(200)
+        data = pageHtml.encode('utf-8')
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeElement:
+    def __init__(self, driver, tag):
+        self.driver = driver
+        self.tag = tag
+
+    def find_elements(self, by, value):
+        return self.driver.findAll(self.tag, by, value)
+
+    def get_attribute(self, name):
+        value = self.tag.get(name)
+        return " ".join(value) if isinstance(value, list) else value
+
+    def click(self):
+        # the only thing the tool clicks is the back button, which switches itself off
+        classes = self.tag.get("class", [])
+        if "myButtonOff" not in classes:
+            self.tag["class"] = classes + ["myButtonOff"]
+            self.driver.page_source = str(self.driver.page)
+
+
+class FakeDriver:
+    # the parts of selenium's webdriver WebFetch uses - get(), page_source, find_element(s) and quit()
+    def __init__(self, profileName=None):
+        self.page = None
+        self.page_source = ""
+
+    def get(self, url):
+        # like a browser, an error page is still a page - it just won't have the content the tool waits for
+        try:
+            with urllib.request.urlopen(url, timeout=60) as response:
+                self.page_source = response.read().decode('utf-8')
+        except urllib.error.HTTPError as e:
+            self.page_source = e.read().decode('utf-8')
+        self.page = BeautifulSoup(self.page_source, ConfigData.HTML_PARSER)
+
+    def find_element(self, by, value):
+        found = self.find_elements(by, value)
+        if len(found) == 0:
+            raise NoSuchElementException("no element for " + by + " " + value)
+        return found[0]
+
+    def find_elements(self, by, value):
+        return [] if self.page is None else self.findAll(self.page, by, value)
+
+    def findAll(self, tag, by, value):
+        if by == By.ID:
+            found = tag.find_all(id=value)
+        elif by == By.CSS_SELECTOR:
+            found = tag.select(value)
+        elif by == By.TAG_NAME:
+            found = tag.find_all(value)
+        else:
+            raise NotImplementedError("FakeDriver can't find elements by " + by)
+        return [FakeElement(self, t) for t in found]
+
+    def get_cookies(self):
+        # what a logged in profile would hand over
+        return [{"name": "mockSession", "value": "fake", "domain": "127.0.0.1", "path": "/"}]
+
+    def quit(self):
+        self.page = None
+        self.page_source = ""
+
+
+def getHarnessParams():
+    params = {"courses": 1, "workers": 1, "pipeline": False, "httpIndex": False, "pgn": Pgn.PGN_INCREMENTAL,
+              "verbose": False, "timeout": 2, "refetchCheck": False}
+    counts = {"-courses": "courses", "-chapters": "chapters", "-variations": "variations", "-latency": "latency",
+              "-failrate": "failrate", "-backon": "backon", "-timeout": "timeout", "-workers": "workers",
+              "-ratelimit": "ratelimit"}
+    i = 0
+    while i + 1 < len(sys.argv):
+        i += 1
+        thisArg = sys.argv[i].lower()
+        if thisArg in counts:
+            i = i + 1
+            if thisArg in ["-latency", "-failrate", "-backon"]:
+                # these can be 0
+                value = int(sys.argv[i]) if i < len(sys.argv) and Utilities.is_integer(sys.argv[i]) else None
+                if value is None:
+                    print("- " + thisArg + " needs a whole number.  Exiting.")
+            else:
+                value = Utilities.getIntOption(i, thisArg[1:])
+            if value is None:
+                return None
+            params[counts[thisArg]] = value
+            continue
+        if thisArg == "-pipeline":
+            params["pipeline"] = True
+            continue
+        if thisArg == "-httpindex":
+            params["httpIndex"] = True
+            continue
+        if thisArg == "-verbose":
+            params["verbose"] = True
+            continue
+        if thisArg == "-refetchcheck":
+            params["refetchCheck"] = True
+            continue
+        if thisArg == "-pgn":
+            i = i + 1
+            params["pgn"] = Utilities.getOptionFromList(i, "pgn mode", Pgn.flagNames)
+            if params["pgn"] is None:
+                return None
+            continue
+        print("- Don't know how to apply command line argument <" + thisArg + ">")
+    return params
+
+
+def loadTool():
+    # chessable-to-pgn.py can't be imported by name
+    spec = importlib.util.spec_from_file_location("chessableToPgn", os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "chessable-to-pgn.py"))
+    tool = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(tool)
+    return tool
+
+
+def runBatch(tool, courses, verbose):
+    if verbose:
+        tool.processBatch(courses, [])
+    else:
+        with contextlib.redirect_stdout(io.StringIO()):
+            tool.processBatch(courses, [])
+
+
+def readCoursePgns(courses):
+    pgns = {}
+    for courseId in courses:
+        fileName = PgnModule.PGN_COURSE_PATH + courseId + ".pgn"
+        if os.path.exists(fileName):
+            with open(fileName, "r", encoding='utf-8') as file:
+                pgns[courseId] = file.read()
+    return pgns
+
+
+def checkFailedRefetch(tool, courses, verbose):
+    # the library is cached by now.  Fetch it again (-web refresh, then -web all) while no course or chapter page can
+    # be had - each run should fall back to the cached pages and write exactly the pgn it wrote the first time
+    expected = readCoursePgns(courses)
+    MockChessableServer.failPageTypes = {"course", "chapter"}
+    ConfigData.FETCH_ATTEMPTS = 1
+    ConfigData.BREAKER_PAUSE = 0
+    passed = True
+    try:
+        for doFetch in [WebFetch.FETCH_REFRESH, WebFetch.FETCH_ALL]:
+            WebFetch.doFetch = doFetch
+            runBatch(tool, courses, verbose)
+            written = readCoursePgns(courses)
+            same = [c for c in courses if c in expected and written.get(c) == expected[c]]
+            print("- refetch check, -web " + WebFetch.flagNames[doFetch] + ": " +
+                  ("passed" if len(same) == len(courses) else "FAILED") + " - " + str(len(same)) + " of " +
+                  str(len(courses)) + " courses written the same with their course and chapter pages failing")
+            passed = passed and len(same) == len(courses)
+    finally:
+        MockChessableServer.failPageTypes = set()
+    return passed
+
+
+def main():
+    params = getHarnessParams()
+    if params is None:
+        return
+    MockChessableServer.chapters = params.get("chapters", MockChessableServer.chapters)
+    MockChessableServer.variations = params.get("variations", MockChessableServer.variations)
+    MockChessableServer.latency = params.get("latency", 0) / 1000
+    MockChessableServer.failRate = params.get("failrate", 0) / 100
+    MockChessableServer.backOnRate = params.get("backon", 0) / 100
+    tool = loadTool()
+
+    with tempfile.TemporaryDirectory() as root:
+        # a fresh cache every run, so every page is fetched, and an empty profile for fetch workers to copy
+        ConfigData.BASE_CHESSABLE_URL = MockChessableServer.start()
+        ConfigData.HTML_CACHE_PATH = root + "/html/"
+        ConfigData.PGN_CACHE_PATH = root + "/pgn/"
+        PgnModule.PGN_COURSE_PATH = ConfigData.PGN_CACHE_PATH + "course/"
+        PgnModule.PGN_VARIATION_PATH = ConfigData.PGN_CACHE_PATH + "variation/"
+        ConfigData.TIMING_LOG_PATH = root + "/log/"
+        ConfigData.TESTING_PROFILE_BASE_DIR = root + "/profile"
+        os.makedirs(ConfigData.TESTING_PROFILE_BASE_DIR + "/" + ConfigData.TESTING_PROFILE)
+        ConfigData.PAGE_READY_TIMEOUTS = {pageType: params["timeout"] for pageType in ConfigData.PAGE_READY_TIMEOUTS}
+        ConfigData.BACK_BUTTON_TIMEOUT = params["timeout"]
+        ConfigData.FETCH_WORKERS = params["workers"]
+        ConfigData.FETCH_PIPELINE = params["pipeline"]
+        ConfigData.FETCH_RATE_LIMIT = params.get("ratelimit", 0)
+        if params["httpIndex"]:
+            ConfigData.FETCH_BACKENDS = dict(ConfigData.FETCH_BACKENDS, course="http", chapter="http")
+        WebFetch.driverFactory = FakeDriver
+        WebFetch.doFetch = WebFetch.FETCH_NEW
+        Pgn.doPgn = params["pgn"]
+        courses = [str(c) for c in range(1, params["courses"] + 1)]
+
+        print("--- " + str(len(courses)) + " courses x " + str(MockChessableServer.chapters) + " chapters x " +
+              str(MockChessableServer.variations) + " variations from " + ConfigData.BASE_CHESSABLE_URL + " ---")
+        start = time.perf_counter()
+        try:
+            runBatch(tool, courses, params["verbose"])
+            if params["refetchCheck"]:
+                checkFailedRefetch(tool, courses, params["verbose"])
+        finally:
+            elapsed = time.perf_counter() - start
+            MockChessableServer.stop()
+
+    served = MockChessableServer.served
+    pages = sum(served.values())
+    print("- served " + str(pages) + " pages (" + ", ".join(t + ": " + str(n) for t, n in served.items()) + ") and " +
+          str(MockChessableServer.failed) + " failures in " + f"{elapsed:.1f}s")
+    if MockChessableServer.withSession > 0:
+        print("- " + str(MockChessableServer.withSession) + " requests sent the browser session's cookies")
+    print(f"- {pages / elapsed:.1f} pages/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Filename: MoveTree.py
+Author: John DeMastri
+Create Date: 2025-05-25
+Version: 0.1
+Description: What a variation page says about the game, without the page.  The header values and a tree of MoveNodes
+are built once from #theOpeningMoves - each node holds what the pgn writer uses from one element: its kind (main line
+move, variation move, comment, annotation, variation, result), move number, SAN, FEN, NAG, key flag, comment text and
+child nodes.  Pgn renders from the tree, and anything else that wants the moves (stats, other formats, checks) can walk
+it instead of the html.
+Trees are kept in the render cache folder as marshalled tuples (<key>.tree, keyed by the html and the parser), so
+rendering a cached library again - with other pgn options, say - loads them instead of parsing the html.
+
+License: MIT License
+Contact: chess@demastri.com
+"""
+import marshal
+
+from bs4.element import Tag
+
+import ConfigData
+from RenderCache import RenderCache
+from Timing import Timing
+from WebFetch import WebFetch
+
+TREE_VERSION = 1  # bump whenever what's kept in a tree changes - it invalidates the cached ones
+TREE_SUFFIX = ".tree"
+TERMINATORS = ["*", "1-0", "0-1", "1/2-1/2"]
+
+# annotation symbols and the pgn nag each is written as
+NAG_STRINGS = {s: " $" + str(n) for s, n in {"!": 1, "?": 2, "!!": 3, "??": 4, "!?": 5, "?!": 6,
+                                              "=": 11, "∞": 13,
+                                              "⩲": 14, "⩱": 15, "±": 16, "∓": 17, "+-": 18, "-+": 19}.items()}
+
+# what the pgn writer needs to know about a node, as bits - worked out once per element from its tag and classes
+IS_SPAN = 1
+IS_DIV = 2
+COMMENT_IN_VARIATION = 4
+OPENING_NUM = 8
+WHITE_MOVE = 16
+BLACK_MOVE = 32
+KEY_MOVE = 64
+COMMENT_MOVE_SMALL = 128
+ANNOTATION = 256
+VARIATION = 512
+NODE_KINDS = {"commentInVariation": COMMENT_IN_VARIATION, "openingNum": OPENING_NUM, "whiteMove": WHITE_MOVE,
+              "blackMove": BLACK_MOVE, "is_key": KEY_MOVE, "commentMoveSmall": COMMENT_MOVE_SMALL,
+              "annotation": ANNOTATION, "commentTopvar": VARIATION, "commentSubvar": VARIATION}
+SPAN_COMMENT = IS_SPAN | COMMENT_IN_VARIATION
+DIV_OPENING_NUM = IS_DIV | OPENING_NUM
+SPAN_MOVE_SMALL = IS_SPAN | COMMENT_MOVE_SMALL
+SPAN_ANNOTATION = IS_SPAN | ANNOTATION
+
+
+def getNag(text):
+    if len(text) >= 2 and text[-2:] in NAG_STRINGS:
+        return NAG_STRINGS[text[-2:]]
+    if len(text) >= 1 and text[-1:] in NAG_STRINGS:
+        return NAG_STRINGS[text[-1:]]
+    # note, this can occur in the next child after the move text:  <span class="annotation" data-original-title="Good move">!</span>
+    return ""
+
+
+class MoveNode:
+    # one element of the moves.  Elements that are only there to hold others (kind 0) are kept too - where a level
+    # starts matters to how an annotation's nag is attached
+    __slots__ = ("kind", "moveNumber", "san", "fen", "nag", "comment", "result", "children")
+
+    def __init__(self, kind, moveNumber=None, san=None, fen=None, nag="", comment=None, result=None, children=()):
+        self.kind = kind
+        self.moveNumber = moveNumber  # "12." on main line moves
+        self.san = san
+        self.fen = fen  # the position after the move
+        self.nag = nag  # " $1" style, for variation moves and annotations
+        self.comment = comment
+        self.result = result  # the game result, on the element that ends the moves
+        self.children = children
+
+    @property
+    def isKey(self):
+        return self.kind & KEY_MOVE != 0
+
+    @property
+    def isVariation(self):
+        return self.kind & IS_SPAN != 0 and self.kind & VARIATION != 0
+
+    def toData(self):
+        return (self.kind, self.moveNumber, self.san, self.fen, self.nag, self.comment, self.result,
+                tuple(child.toData() for child in self.children))
+
+    @classmethod
+    def fromData(cls, data):
+        kind, moveNumber, san, fen, nag, comment, result, children = data
+        return MoveNode(kind, moveNumber, san, fen, nag, comment, result, [MoveNode.fromData(c) for c in children])
+
+
+class VariationTree:
+    # the header values and moves of one variation page
+    __slots__ = ("name", "chapter", "fen", "result", "moves")
+
+    def __init__(self, name, chapter, fen, result, moves):
+        self.name = name
+        self.chapter = chapter  # text of the course / author / chapter details, in page order
+        self.fen = fen  # the starting position
+        self.result = result
+        self.moves = moves
+
+    def toData(self):
+        return (TREE_VERSION, self.name, tuple(self.chapter), self.fen, self.result,
+                tuple(node.toData() for node in self.moves))
+
+    @classmethod
+    def fromData(cls, data):
+        version, name, chapter, fen, result, moves = data
+        return VariationTree(name, list(chapter), fen, result, [MoveNode.fromData(node) for node in moves])
+
+
+class MoveTree:
+
+    @classmethod
+    def fromText(cls, variationText):
+        # the tree for unparsed variation html - from the tree cache if it's there, otherwise parsed and built
+        if not ConfigData.TREE_CACHE:
+            return MoveTree.fromHtml(WebFetch.parseHtml(variationText))
+        key = RenderCache.getKey(variationText, [TREE_VERSION, ConfigData.HTML_PARSER])
+        data = RenderCache.getData(key, TREE_SUFFIX)
+        if data is not None:
+            try:
+                with Timing.stage("move tree load"):
+                    tree = VariationTree.fromData(marshal.loads(data))
+                Timing.count("tree cache hit")
+                return tree
+            except (ValueError, EOFError, TypeError):
+                pass  # written by another python version, or cut short - build it again
+        Timing.count("tree cache miss")
+        tree = MoveTree.fromHtml(WebFetch.parseHtml(variationText))
+        if tree is not None:
+            RenderCache.putData(key, marshal.dumps(tree.toData()), TREE_SUFFIX)
+        return tree
+
+    @classmethod
+    def fromHtml(cls, variationBs):
+        # None if the page doesn't have the parts a variation needs
+        name, chapter, moves, term, inputFEN = WebFetch.getVariationParts(variationBs)
+        if chapter == []:
+            return None
+        with Timing.stage("move tree build"):
+            return VariationTree(name, [li.text for li in chapter], inputFEN, MoveTree.getResult(term),
+                                 MoveTree.buildNodes(moves))
+
+    @classmethod
+    def getResult(cls, term):
+        for x in term:
+            if x.text.strip() in TERMINATORS:
+                return x.text
+        return "*"
+
+    @classmethod
+    def buildNodes(cls, tags):
+        nodes = []
+        for c in tags:
+            # one pass over the element's classes tells us everything we need to know about it
+            kind = 0
+            classes = c.get("class")
+            if classes is not None:
+                for className in classes:
+                    kind |= NODE_KINDS.get(className, 0)
+            if c.name == "span":
+                kind |= IS_SPAN
+            elif c.name == "div":
+                kind |= IS_DIV
+
+            node = MoveNode(kind)
+            if kind & SPAN_COMMENT == SPAN_COMMENT:
+                node.comment = c.text
+            if kind & DIV_OPENING_NUM == DIV_OPENING_NUM and c.text.strip() in TERMINATORS:
+                node.result = c.text
+            if kind & IS_DIV and kind & (WHITE_MOVE | BLACK_MOVE):
+                node.moveNumber = c.get("data-move")
+                node.san = c.get("data-san")
+                node.fen = c.get("data-fen")
+            if kind & SPAN_MOVE_SMALL == SPAN_MOVE_SMALL and c.get("data-san") is not None:
+                node.san = c["data-san"]
+                node.fen = c.get("data-fen")
+                # nag could be included in display text
+                node.nag = getNag(c.text)
+            if kind & SPAN_ANNOTATION == SPAN_ANNOTATION and c.get("data-original-title") is not None and \
+                    c["data-original-title"] != "":
+                # or nag could be defined in a separate span
+                node.nag = getNag(c.text)
+            # the same tags find_all(recursive=False) gives, without setting up a search for each element
+            kids = [k for k in c.contents if isinstance(k, Tag)]
+            if len(kids) > 0:
+                node.children = MoveTree.buildNodes(kids)
+            nodes.append(node)
+        return nodes
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Filename: OpeningBook.py
+Author: John DeMastri
+Create Date: 2025-05-26
+Version: 0.1
+Description: Writes cached courses out as a Polyglot opening book (.bin), so engines and GUIs can look a position up
+in the repertoire instead of importing the course pgn.  Every move in a variation's move tree becomes a book entry for
+the position it was played from: the position's Polyglot (Zobrist) key, the move, and a weight.  Entries are sorted by
+key, so a lookup is a binary search.
+A move's weight is the number of times the courses play it, with key moves counting BOOK_KEY_WEIGHT times, and scaled
+by its annotation (NAG_WEIGHTS) - a "?" or "??" move is kept with weight 0, so it's in the book but never chosen.
+Only the html cache is read.  The chess rules and Polyglot keys come from python-chess (pip install chess), which is
+only needed for this.
+
+License: MIT License
+Contact: chess@demastri.com
+"""
+import importlib.util
+import struct
+from pathlib import Path
+
+import ConfigData
+from CourseManifest import CourseManifest
+from MoveTree import MoveTree, SPAN_ANNOTATION
+from Timing import Timing
+from WebFetch import WebFetch
+from WorkQueue import WorkQueue
+
+ENTRY_FORMAT = ">QHHI"  # key, move, weight, learn - big endian, 16 bytes
+MAX_WEIGHT = 0xffff
+# how an annotation scales the weight of the move it's on:  !  ?  !!  ??  !?  ?!
+NAG_WEIGHTS = {" $1": 2.0, " $2": 0.0, " $3": 4.0, " $4": 0.0, " $5": 1.0, " $6": 0.5}
+
+
+class BookLine:
+    # where a line of moves has got to - the position before its last move as well, since a variation's first move
+    # can be an alternative to that move or carry on from it
+    __slots__ = ("before", "after", "last")
+
+    def __init__(self, before, after):
+        self.before = before
+        self.after = after
+        self.last = None  # [entry key, weight] of the last move, for an annotation that follows it
+
+
+class OpeningBook:
+
+    @classmethod
+    def isAvailable(cls):
+        return importlib.util.find_spec("chess") is not None
+
+    @classmethod
+    def writeBook(cls, courses, variations):
+        # the book is built from what's cached - nothing is fetched
+        WebFetch.doFetch = WebFetch.FETCH_NONE
+        weights = {}  # (zobrist key, polyglot move) -> weight
+        treesRead = 0
+        for courseId in courses:
+            print("--- adding course " + courseId + " to the book ---")
+            manifest = CourseManifest.getManifest(courseId, "Default")
+            for chapter in manifest["chapters"]:
+                for variation in chapter["variations"]:
+                    treesRead += OpeningBook.addVariation(weights, courseId, variation["id"])
+        for variationId in variations:
+            treesRead += OpeningBook.addVariation(weights, WorkQueue.ONE_OFF, variationId)
+
+        entries = OpeningBook.getEntries(weights)
+        Path(ConfigData.BOOK_FILE).parent.mkdir(parents=True, exist_ok=True)
+        with Timing.stage("book write"), open(ConfigData.BOOK_FILE, "wb") as file:
+            for entry in entries:
+                file.write(struct.pack(ENTRY_FORMAT, *entry, 0))
+        print("- " + str(len(entries)) + " moves from " + str(treesRead) + " variations written to " +
+              ConfigData.BOOK_FILE)
+        return len(entries)
+
+    @classmethod
+    def addVariation(cls, weights, courseId, variationId):
+        # returns 1 if the variation was added, 0 if it isn't cached
+        variationText = WebFetch.getVariationText(variationId, courseId, "Default")
+        tree = None if variationText is None else MoveTree.fromText(variationText)
+        if tree is None:
+            print(" - no HTML found for variation " + variationId)
+            return 0
+        import chess
+
+        occurrences = []
+        with Timing.stage("book moves"):
+            OpeningBook.addMoves(tree.moves, BookLine(None, chess.Board(tree.fen)), occurrences)
+        for entryKey, weight in occurrences:
+            weights[entryKey] = weights.get(entryKey, 0) + weight
+        return 1
+
+    @classmethod
+    def addMoves(cls, nodes, line, occurrences):
+        # in the same order the pgn is written, so an annotation follows the move it's on
+        for node in nodes:
+            # only move nodes (main line and variation) have a san
+            if node.san is not None and node.fen is not None:
+                OpeningBook.addMove(node, line, occurrences)
+            if node.kind & SPAN_ANNOTATION == SPAN_ANNOTATION and node.nag != "" and line.last is not None:
+                line.last[1] *= NAG_WEIGHTS.get(node.nag, 1.0)
+            if node.isVariation:
+                OpeningBook.addMoves(node.children, BookLine(line.before, line.after), occurrences)
+            else:
+                OpeningBook.addMoves(node.children, line, occurrences)
+
+    @classmethod
+    def addMove(cls, node, line, occurrences):
+        import chess.polyglot
+
+        for board in (line.after, line.before):
+            if board is None:
+                continue
+            try:
+                move = board.parse_san(node.san)
+            except ValueError:
+                continue
+            after = board.copy(stack=False)
+            after.push(move)
+            # the page's fen is the position after the move - it tells carrying on from an alternative apart
+            if after.fen().split()[:2] != node.fen.split()[:2]:
+                continue
+            weight = (ConfigData.BOOK_KEY_WEIGHT if node.isKey else 1) * NAG_WEIGHTS.get(node.nag, 1.0)
+            line.last = [(chess.polyglot.zobrist_hash(board), OpeningBook.encodeMove(board, move)), weight]
+            occurrences.append(line.last)
+            line.before, line.after = board, after
+            return
+        # not a move from where the line was - pick the line up again from the page's position
+        Timing.count("book move skipped")
+        line.before, line.after, line.last = None, chess.Board(node.fen), None
+
+    @classmethod
+    def encodeMove(cls, board, move):
+        # polyglot moves are to square, from square, promotion piece - with castling written as the king taking its
+        # own rook
+        import chess
+
+        toSquare = move.to_square
+        if board.is_castling(move):
+            toSquare = chess.square(7 if board.is_kingside_castling(move) else 0, chess.square_rank(move.from_square))
+        promotion = move.promotion - 1 if move.promotion else 0  # knight 1 .. queen 4
+        return toSquare | move.from_square << 6 | promotion << 12
+
+    @classmethod
+    def getEntries(cls, weights):
+        # (key, move, weight) sorted by key, then by weight, highest first.  A position's weights are only compared
+        # with each other, so they're scaled down together if the biggest won't fit
+        positions = {}
+        for (key, move), weight in weights.items():
+            positions.setdefault(key, []).append((move, weight))
+        entries = []
+        for key in sorted(positions):
+            moves = positions[key]
+            scale = MAX_WEIGHT / max(MAX_WEIGHT, max(weight for move, weight in moves))
+            for move, weight in sorted(moves, key=lambda m: (-m[1], m[0])):
+                entries.append((key, move, 0 if weight == 0 else max(1, round(weight * scale))))
+        return entries
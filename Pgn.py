@@ -11,24 +11,35 @@ Given variation information as bs4 elements and walks it to find header, move an
 License: MIT License
 Contact: chess@demastri.com
 """
+import os
 import re
 from pathlib import Path
 
+import MoveTree as MoveTreeModule
 import Utilities
-from WebFetch import WebFetch
+from MoveTree import MoveTree, IS_DIV, WHITE_MOVE, BLACK_MOVE, KEY_MOVE, SPAN_COMMENT, DIV_OPENING_NUM, \
+    SPAN_MOVE_SMALL, SPAN_ANNOTATION
+from RenderCache import RenderCache
+from Timing import Timing
 import ConfigData
 
 PGN_COURSE_PATH = ConfigData.PGN_CACHE_PATH + 'course/'
 PGN_VARIATION_PATH = ConfigData.PGN_CACHE_PATH + 'variation/'
-PGN_WRITE_KEY_MOVE = True
 
 STARTING_POSITION = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"  # starting position
+BRACKETS = re.compile(r'[(){}]')
+RENDERER_VERSION = 1  # bump whenever a change here changes the pgn written - it invalidates the render cache
 
-count = 0
-firstMove = True
-lastSeenFenParts = ""
-lastSeenSan = ""
-keyWritten = False
+class PgnState:
+    # what buildMoveBody tracks while it walks one variation.  Each render gets its own, so variations can be
+    # rendered independently (and in separate processes)
+    def __init__(self, writeKeyMove):
+        self.count = 0
+        self.firstMove = True
+        self.lastSeenFenParts = ""
+        self.lastSeenSan = ""
+        self.keyWritten = False
+        self.writeKeyMove = writeKeyMove
 
 
 class Pgn:
@@ -38,29 +49,44 @@ class Pgn:
     flagNames = ["none", "incremental", "after"]
 
     doPgn = PGN_INCREMENTAL
+    PGN_WRITE_KEY_MOVE = True
 
     def __init__(self):
         Pgn.doPgn = Pgn.PGN_INCREMENTAL
 
+    @classmethod
+    def createPgnFromText(cls, courseId: str, variationId, variationText, roundStr):
+        # render from unparsed variation html, using the render cache when it's on
+        if variationText is None:
+            return None
+        if not ConfigData.RENDER_CACHE:
+            return Pgn.createPgnFromTree(courseId, variationId, MoveTree.fromText(variationText), roundStr)
+        key = RenderCache.getKey(variationText, [RENDERER_VERSION, Pgn.PGN_WRITE_KEY_MOVE, ConfigData.HTML_PARSER,
+                                                 ConfigData.BASE_CHESSABLE_URL, courseId, variationId, roundStr])
+        pgnOut = RenderCache.get(key)
+        if pgnOut is None:
+            pgnOut = Pgn.createPgnFromTree(courseId, variationId, MoveTree.fromText(variationText), roundStr)
+            if pgnOut is not None:
+                RenderCache.put(key, pgnOut)
+        return pgnOut
+
     @classmethod
     def createPgnFromHtml(cls, courseId: str, variationId, variation, roundStr):
-        global count
-        global firstMove
-        global keyWritten
-        count = 0
-        firstMove = True
-        keyWritten = False
+        return Pgn.createPgnFromTree(courseId, variationId, MoveTree.fromHtml(variation), roundStr)
 
-        name, chapter, moves, term, inputFEN = WebFetch.getVariationParts(variation)
+    @classmethod
+    def createPgnFromTree(cls, courseId: str, variationId, tree, roundStr):
+        state = PgnState(Pgn.PGN_WRITE_KEY_MOVE)
 
-        if chapter == []:
+        if tree is None:
             print(" - HTML not found for variation")
             return None
-        if inputFEN != STARTING_POSITION:
+        if tree.fen != STARTING_POSITION:
             print("Variation does not begin at starting position")
-        result = Pgn.getGameResult(term)
-        outPgn = Pgn.buildHeader(courseId, variationId, name, chapter, result, roundStr, inputFEN)
-        outPgn += Pgn.buildMoveBody(moves, 0)
+        result = tree.result
+        outPgn = Pgn.buildHeader(courseId, variationId, tree.name, tree.chapter, result, roundStr, tree.fen)
+        with Timing.stage("buildMoveBody"):
+            outPgn += Pgn.renderMoveTree(tree.moves, 0, state)
         # there's are two odd chessbase bugs in PGN Import - see included "ChessBase import issue.pgn":
         #  found In CB17, v37 - May '25
         # 1 - if there's are trailing comment(s) in a game (nothing after it but the game terminator)
@@ -76,14 +102,13 @@ class Pgn:
         #   then insert a null move prior to the last comment so it renders more correctly
         #   (CB ignores whitespace anyway, might make processing easier to concatenate comments (s/} {//)
         # 2 - look at the last item in any comment set.  If it's a number, tack on something ("_") so CB ignores it
-        outPgn = outPgn.replace( "}  {", "") # clear sequential comments, CB ignores the whitespace...
-        outPgn, allOpens, allCloses = insertNullMoveBeforeLastComment(outPgn)
-        outPgn = escapeLastNumberInComments(outPgn, allOpens, allCloses)
+        with Timing.stage("chessbase passes"):
+            outPgn = applyChessBaseWorkarounds(outPgn)
         outPgn += Pgn.buildGameResult(result)
         return re.sub(r' +', ' ', outPgn)
 
     @classmethod
-    def buildHeader(cls, courseId, variationId, name: str, chapter, result, roundStr, FEN):
+    def buildHeader(cls, courseId, variationId, name: str, chapter: list, result, roundStr, FEN):
         # we have 6 pieces of info to be conveyed: course, chapter, variation title, variation url, location as round, and result
         # these can be mapped as:
         #  result => Result
@@ -94,8 +119,9 @@ class Pgn:
         #  variation title => Black
         # Most viewers break the names into first and last based on the ',' character
         # We can prevent that by replacing any "," with '-' (can see if this looks ok...)
-        courseTitle = re.sub(r'\s+', ' ', chapter[0].text.replace("\n", "")).strip()
-        chapterTitle = re.sub(r'\s+', ' ', chapter[2].text.replace("\n", "")).strip().replace(",", "-")
+        # chapter is the text of the variation's details - course name, author, chapter name
+        courseTitle = re.sub(r'\s+', ' ', chapter[0].replace("\n", "")).strip()
+        chapterTitle = re.sub(r'\s+', ' ', chapter[2].replace("\n", "")).strip().replace(",", "-")
         variationTitle = re.sub(r'\s+', ' ', name.replace("\n", "")).strip().replace(",", "-")
         variationUrl = ConfigData.BASE_CHESSABLE_URL + "variation/" + str(variationId)
 
@@ -114,124 +140,115 @@ class Pgn:
         return header
 
     @classmethod
-    def buildMoveBody(cls, moves, depth):
-        global count
-        global firstMove
-        global lastSeenFenParts
-        global lastSeenSan
-        global keyWritten
+    def buildMoveBody(cls, moves, depth, state):
+        # move text straight from the html's move tags
+        return Pgn.renderMoveTree(MoveTree.buildNodes(moves), depth, state)
+
+    @classmethod
+    def renderMoveTree(cls, nodes, depth, state):
+        # tokens are collected in one list for the whole tree and joined once at the end, instead of each level
+        # copying its kids' output into its own string
+        tokens = []
+        Pgn.emitMoveBody(nodes, depth, state, tokens)
+        return "".join(tokens)
 
+    @classmethod
+    def emitMoveBody(cls, nodes, depth, state, tokens):
         # Notes:
         #  c.text is actually recursive.  CommentInMove is not a PGN comment, contains both variations and comments!!
         #    when we know what we're working on, wrap variations in (), comments in {}
         #  ToDo: text has some formatting <h1>...that should be better represented in PGN comments (whether CB reads or not)
-        outString = ""
+        #  everything this level writes goes on the end of tokens, from levelStart on
+        levelStart = len(tokens)
         depth += 1
-        count += 1
+        state.count += 1
         # print(" " * depth + "x")
-        outString = ""
-
-        for c in moves:
-            firstKey = False
-            if c.name == "span" and c.get("class") is not None and "commentInVariation" in c["class"]:
-                outString += " { " + c.text + " } "
-            if c.name == "div" and c.get("class") is not None and (
-                    "openingNum" in c["class"] and Pgn.isTerminator(c.text)):
-                outString += "\n\n " + c.text + "\n\n"
-
-            if c.name == "div" and c.get("class") is not None and (
-                    "whiteMove" in c["class"] or "blackMove" in c["class"]):
+
+        for c in nodes:
+            kind = c.kind
+            if kind & SPAN_COMMENT == SPAN_COMMENT:
+                tokens.append(" { " + c.comment + " } ")
+            if kind & DIV_OPENING_NUM == DIV_OPENING_NUM and c.result is not None:
+                tokens.append("\n\n " + c.result + "\n\n")
+
+            if kind & IS_DIV and kind & (WHITE_MOVE | BLACK_MOVE):
                 keyStr = ""
-                if PGN_WRITE_KEY_MOVE and "is_key" in c["class"]:
-                    if not keyWritten:
-                        keyWritten = True
+                if state.writeKeyMove and kind & KEY_MOVE:
+                    if not state.keyWritten:
+                        state.keyWritten = True
                         keyStr = " { -KEY- } "
 
-                if firstMove or "whiteMove" in c["class"]:
-                    outString += c["data-move"] + " "
-                    firstMove = False
-
-                outString += keyStr + c["data-san"] + " "
-                lastSeenSan = c["data-san"]
-                lastSeenFenParts = c["data-fen"].split()
-            if c.name == "span" and c.get("class") is not None and "commentMoveSmall" in c["class"]:
-                if c.get("data-san") is not None:
-                    fenParts = c[
-                        'data-fen'].split()  # "2r2rk1/3nbpp1/pp1p3P/4pP2/P1q2P2/2N1BQ2/1Pn3BP/3R1R1K b - - 0 22"
-                    if not firstMove and isWhite == fenParts[1]:  # two successive moves with the same color
-                        print(" ### repeated move?? ### " + c["data-san"])
+                if state.firstMove or kind & WHITE_MOVE:
+                    tokens.append(c.moveNumber + " ")
+                    state.firstMove = False
+
+                tokens.append(keyStr + c.san + " ")
+                state.lastSeenSan = c.san
+                state.lastSeenFenParts = c.fen.split()
+            if kind & SPAN_MOVE_SMALL == SPAN_MOVE_SMALL:
+                if c.san is not None:
+                    fenParts = c.fen.split()  # "2r2rk1/3nbpp1/pp1p3P/4pP2/P1q2P2/2N1BQ2/1Pn3BP/3R1R1K b - - 0 22"
+                    if not state.firstMove and isWhite == fenParts[1]:  # two successive moves with the same color
+                        print(" ### repeated move?? ### " + c.san)
                     isWhite = fenParts[1] == "b"  # after this move...
                     moveNbr = int(fenParts[5])  # if it's white to move before this fen, then the number is 1 high
                     if not isWhite:
                         moveNbr -= 1
                     moveNbr = str(moveNbr)
-                    if firstMove and fenParts[1] != lastSeenFenParts[1]:
+                    if state.firstMove and fenParts[1] != state.lastSeenFenParts[1]:
                         # this is likely enough of a check...  repeat the last move seen
                         # this is a first move in a variation. it should be able to replace the last move seen
                         # if it's the next move. we need to repeat the prior move
                         # this can be seen at the end of a game, when the author provides a potential or actual continuation
                         # so it's a ply behind where this move thinks it is...
                         # print( "Mismatch onMove in variation ..." )
-                        # print( lastSeenFenParts, fenParts )
+                        # print( state.lastSeenFenParts, fenParts )
                         moveNbr = moveNbr if not isWhite else str(int(moveNbr) - 1)
                         isWhite = not isWhite
-                        outString += moveNbr
-                        if isWhite:
-                            outString += ". "
-                        else:
-                            outString += "... "
-                        outString += lastSeenSan + " "
+                        tokens.append(moveNbr + (". " if isWhite else "... ") + state.lastSeenSan + " ")
                         # ok, now set up to handle this actual move
-                        firstMove = False
+                        state.firstMove = False
                         isWhite = not isWhite
 
-                    if firstMove or isWhite:
-                        outString += moveNbr
-                        if isWhite:
-                            outString += ". "
-                        else:
-                            outString += "... "
-                        firstMove = False
-                    outString += c["data-san"]
-                    if Pgn.getNag(c.text) != "":
-                        outString += Pgn.getNag(c.text)  # nag could be included in display text
-                    outString += " "
-            if c.name == "span" and c.get("class") is not None and "annotation" in c["class"] and c.get(
-                    "data-original-title") is not None and c["data-original-title"] != "" and Pgn.getNag(c.text) != "":
-                outString = outString[:-1] + Pgn.getNag(c.text) + " "  # or nag could be defined in a separate span
+                    if state.firstMove or isWhite:
+                        tokens.append(moveNbr + (". " if isWhite else "... "))
+                        state.firstMove = False
+                    # nag could be included in display text
+                    tokens.append(c.san + c.nag + " ")
+            if kind & SPAN_ANNOTATION == SPAN_ANNOTATION and c.nag != "":
+                # or nag could be defined in a separate span - it replaces the space after what this level wrote
+                Pgn.dropLastCharacter(tokens, levelStart)
+                tokens.append(c.nag + " ")
 
             # for embedded variations, write "(" then kids pgn, then ")"
-            if c.name == "span" and c.get("class") is not None and (
-                    "commentTopvar" in c["class"] or "commentSubvar" in c["class"]):
-                outString += " ( "
-                firstMove = True
+            isVariation = c.isVariation
+            if isVariation:
+                tokens.append(" ( ")
+                state.firstMove = True
 
             # in any event, make sure we write any kid nodes' data
-            kids = c.findChildren(recursive=False)
-            outString = outString + Pgn.buildMoveBody(kids, depth)
+            Pgn.emitMoveBody(c.children, depth, state, tokens)
 
-            if c.name == "span" and c.get("class") is not None and (
-                    "commentTopvar" in c["class"] or "commentSubvar" in c["class"]):
-                outString += " ) \n"
+            if isVariation:
+                tokens.append(" ) \n")
 
         # print(" " * depth + "/x")
 
         depth -= 1
 
-        return outString
+    @classmethod
+    def dropLastCharacter(cls, tokens, levelStart):
+        # tokens are never empty, but one can become empty here - keep going back until a character comes off
+        while len(tokens) > levelStart:
+            last = tokens.pop()
+            if last != "":
+                if len(last) > 1:
+                    tokens.append(last[:-1])
+                return
 
     @classmethod
     def getNag(cls, c):
-        nagStrings = {"!": 1, "?": 2, "!!": 3, "??": 4, "!?": 5, "?!": 6,
-                      "=": 11, "∞": 13,
-                      "⩲": 14, "⩱": 15, "±": 16, "∓": 17, "+-": 18, "-+": 19}
-
-        if (len(c) >= 2 and c[len(c) - 2:] in nagStrings.keys()):
-            return " $" + str(nagStrings[c[len(c) - 2:]])
-        if (len(c) >= 1 and c[len(c) - 1:] in nagStrings.keys()):
-            return " $" + str(nagStrings[c[len(c) - 1:]])
-        # note, this can occur in the next child after the move text:  <span class="annotation" data-original-title="Good move">!</span>
-        return ""
+        return MoveTreeModule.getNag(c)
 
     @classmethod
     def isTerminator(cls, s):
@@ -245,26 +262,40 @@ class Pgn:
         mode = "a" if incremental else "w"
         path = Path(PGN_COURSE_PATH)
         path.mkdir(parents=True, exist_ok=True)
-        with open(PGN_COURSE_PATH + courseId + ".pgn", mode, encoding='utf-8') as file:
+        with Timing.stage("pgn write"), open(PGN_COURSE_PATH + courseId + ".pgn", mode, encoding='utf-8') as file:
             return file.write(pgnOut)
 
+    @classmethod
+    def writeCoursePgnStream(cls, courseId, pgns):
+        # writes each game from pgns as it arrives, so only one is held at a time.  It's written under a temporary
+        # name and only replaces the course file once the whole course is done
+        path = Path(PGN_COURSE_PATH)
+        path.mkdir(parents=True, exist_ok=True)
+        fileName = PGN_COURSE_PATH + courseId + ".pgn"
+        written = 0
+        with open(fileName + ".tmp", "w", encoding='utf-8') as file:
+            for pgnOut in pgns:
+                with Timing.stage("pgn write"):
+                    written += file.write(pgnOut)
+        os.replace(fileName + ".tmp", fileName)
+        return written
+
     @classmethod
     def writeVariationPgnFile(cls, variationId, pgnOut):
         path = Path(PGN_VARIATION_PATH)
         path.mkdir(parents=True, exist_ok=True)
-        with open(PGN_VARIATION_PATH + variationId + ".pgn", "w", encoding='utf-8') as file:
+        with Timing.stage("pgn write"), open(PGN_VARIATION_PATH + variationId + ".pgn", "w", encoding='utf-8') as file:
             return file.write(pgnOut)
 
     @classmethod
     def buildGameResult(cls, result):
         return "\n " + result + " \n\n"
 
-    @classmethod
-    def getGameResult(cls, result):
-        for x in result:
-            if Pgn.isTerminator(x.text):
-                return x.text
-        return "*"
+
+def applyChessBaseWorkarounds(pgn):
+    pgn = pgn.replace("}  {", "")  # clear sequential comments, CB ignores the whitespace...
+    pgn, allOpens, allCloses = insertNullMoveBeforeLastComment(pgn)
+    return escapeLastNumberInComments(pgn, allOpens, allCloses)
 
 
 def insertNullMoveBeforeLastComment(pgn):
@@ -279,47 +310,53 @@ def insertNullMoveBeforeLastComment(pgn):
 
 
 def escapeLastNumberInComments(pgn, opens, closes):
+    # note: when insertNullMoveBeforeLastComment added " Z0 ", opens/closes still hold the positions from before it.
+    #  that's how this has always run, and changing it would change the pgn written for those games
     curStart = 0
-    outPgn = ""
+    outPgn = []
     curOpen = []
+    nextOpen = 0
     for thisClose in closes:
-        while len(opens) > 0 and (len(curOpen) == 0 or opens[0] < thisClose):
-            curOpen.append(opens[0])
-            opens = opens[1:]
+        while nextOpen < len(opens) and (len(curOpen) == 0 or opens[nextOpen] < thisClose):
+            curOpen.append(opens[nextOpen])
+            nextOpen += 1
         thisOpen = curOpen.pop()
         # here thisopen, thisClose are the current nested comment we're dealing with.
         # if the next open is only 3 away "}  {", we don't have to worry about this pair
         if len(pgn) > thisClose+3 and pgn[thisClose+3] == "{":
             continue
         # ok - not followed by another comment, let's see if the last elt in this set is a number
-        parts = pgn[thisOpen:thisClose].split()
+        parts = pgn[thisOpen:thisClose].rsplit(None, 1)
         if len(parts) > 0 and Utilities.is_integer(parts[len(parts) - 1]):
             # we have to escape this.
             print(" Found a comment set ending in a number")
-            outPgn = outPgn + pgn[curStart:thisClose+1] + " { _ } "
+            outPgn.append(pgn[curStart:thisClose+1])
+            outPgn.append(" { _ } ")
             curStart = thisClose+1
-    outPgn = outPgn + pgn[curStart:]
+    outPgn.append(pgn[curStart:])
 
-    return outPgn
+    return "".join(outPgn)
 
 
 def findLastRootComment(pgn):
+    # only brackets matter here, so let the regex engine skip everything else
     opens = []
     closes = []
     depth = 1
     curLast = -1
-    for i in range(len(pgn)):
-        ch = pgn[i]
+    for found in BRACKETS.finditer(pgn):
+        ch = found.group()
         if ch == "(":
             depth += 1
-        if ch == ")":
+        elif ch == ")":
             depth -= 1
-        if ch == "{":
+        elif ch == "{":
+            i = found.start()
             opens.append(i)
             if depth == 1:
                 curLast = i
-        if ch == "}":
-            closes.append(i)
+        else:
+            closes.append(found.start())
     return curLast, opens, closes
 
 
@@ -348,9 +385,7 @@ def findLastMove(pgn):
 
     depth = 1
     parts = pgn.split()
-    for i in range(len(parts)):
-        part = parts[i]
-
+    for i, part in enumerate(parts):
         if depth == 1 and part == "{":
             inComment = True
             lastComment = i
@@ -365,14 +400,14 @@ def findLastMove(pgn):
             depth -= 1
             if depth == 1:
                 inVariation = False
-        elif part.find("[") == 0 and not inTag:
+        elif not inTag and part.startswith("["):
             inTag = True
-        elif part.find("]") == len(part) - 1 and inTag:
+        elif inTag and part.find("]") == len(part) - 1:
             inTag = False
         elif depth == 1 and not inComment and not inVariation and not inTag:  # possible move
-            if part[len(part) - 1:] == ".":  # move number
+            if part.endswith("."):  # move number
                 continue
-            if part.find("$") == 0:  # diacritic
+            if part.startswith("$"):  # diacritic
                 continue
             if part == "Z0":  # null move
                 continue
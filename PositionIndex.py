@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Filename: PositionIndex.py
+Author: John DeMastri
+Create Date: 2025-05-27
+Version: 0.1
+Description: An index of every position in the cached courses, so "which of my courses reach this position" is one
+query instead of a search through pgn files.  Each variation's start position and the position after every move
+(main line and variations, from the data-fen of the moves) is recorded against its course, chapter, variation,
+Round and ply, in a sqlite file under PGN_CACHE_PATH (POSITION_INDEX_FILE).
+Positions are kept as the first three fields of the fen - pieces, side to move and castling rights - so the same
+position matches whatever the move counters and en passant square say.
+The index is kept up to date as variations are rendered: a variation is only indexed again when its html (or its
+Round) has changed since.  -findFen looks a position up.
+
+License: MIT License
+Contact: chess@demastri.com
+"""
+import os
+import sqlite3
+import threading
+
+import ConfigData
+from MoveTree import MoveTree
+from RenderCache import RenderCache
+from Timing import Timing
+
+INDEX_VERSION = 1  # bump whenever what's indexed changes - variations are indexed again on the next run
+
+
+class PositionIndex:
+    findFen = None  # the position -findFen looks up
+    # each thread gets its own connection - sqlite connections can't be shared between threads
+    threadState = threading.local()
+
+    @classmethod
+    def getIndexFileName(cls):
+        return ConfigData.PGN_CACHE_PATH + ConfigData.POSITION_INDEX_FILE
+
+    @classmethod
+    def getConnection(cls):
+        # one connection per process (and thread) - a connection inherited from a parent process can't be used safely
+        indexFile = PositionIndex.getIndexFileName()
+        state = PositionIndex.threadState
+        if getattr(state, "connection", None) is None or state.pid != os.getpid() or state.file != indexFile:
+            os.makedirs(ConfigData.PGN_CACHE_PATH, exist_ok=True)
+            state.connection = sqlite3.connect(indexFile, timeout=60, isolation_level=None)
+            state.connection.execute("PRAGMA journal_mode=WAL")
+            state.connection.execute("PRAGMA synchronous=NORMAL")  # it can always be built again from the cache
+            state.connection.execute("CREATE TABLE IF NOT EXISTS variations (id INTEGER PRIMARY KEY, courseId TEXT, "
+                                     "variationId TEXT, round TEXT, chapter TEXT, name TEXT, sourceKey TEXT, "
+                                     "UNIQUE (courseId, variationId))")
+            state.connection.execute("CREATE TABLE IF NOT EXISTS positions (fen TEXT, variation INTEGER, "
+                                     "ply INTEGER)")
+            state.connection.execute("CREATE INDEX IF NOT EXISTS positionsByFen ON positions (fen)")
+            state.connection.execute("CREATE INDEX IF NOT EXISTS positionsByVariation ON positions (variation)")
+            state.pid = os.getpid()
+            state.file = indexFile
+        return state.connection
+
+    @classmethod
+    def close(cls):
+        state = PositionIndex.threadState
+        if getattr(state, "connection", None) is not None and state.pid == os.getpid():
+            state.connection.close()
+        state.connection = None
+
+    @classmethod
+    def normalizeFen(cls, fen):
+        return " ".join(fen.split()[:3])
+
+    @classmethod
+    def getPly(cls, fen):
+        # half moves from the start of the game to this position
+        parts = fen.split()
+        fullMove = int(parts[5]) if len(parts) > 5 and parts[5].isdigit() else 1
+        return (fullMove - 1) * 2 + (1 if len(parts) > 1 and parts[1] == "b" else 0)
+
+    @classmethod
+    def addVariation(cls, courseId, variationId, roundStr, variationText):
+        # returns True if the variation was (re)indexed, False if the index already had it
+        sourceKey = RenderCache.getKey(variationText, [INDEX_VERSION, roundStr])
+        connection = PositionIndex.getConnection()
+        row = connection.execute("SELECT sourceKey FROM variations WHERE courseId = ? AND variationId = ?",
+                                 (courseId, variationId)).fetchone()
+        if row is not None and row[0] == sourceKey:
+            Timing.count("position index current")
+            return False
+        tree = MoveTree.fromText(variationText)
+        if tree is None:
+            return False
+        with Timing.stage("position index"):
+            positions = {}
+            PositionIndex.addPosition(tree.fen, positions)
+            PositionIndex.addTreePositions(tree.moves, positions)
+            connection.execute("BEGIN")
+            connection.execute("DELETE FROM positions WHERE variation IN (SELECT id FROM variations WHERE "
+                               "courseId = ? AND variationId = ?)", (courseId, variationId))
+            connection.execute("DELETE FROM variations WHERE courseId = ? AND variationId = ?", (courseId, variationId))
+            rowId = connection.execute(
+                "INSERT INTO variations (courseId, variationId, round, chapter, name, sourceKey) VALUES "
+                "(?, ?, ?, ?, ?, ?)", (courseId, variationId, roundStr, tree.chapter[2].strip(), tree.name.strip(),
+                                       sourceKey)).lastrowid
+            connection.executemany("INSERT INTO positions (fen, variation, ply) VALUES (?, ?, ?)",
+                                   ((fen, rowId, ply) for fen, ply in positions.items()))
+            connection.execute("COMMIT")
+        Timing.count("position index update")
+        return True
+
+    @classmethod
+    def addTreePositions(cls, nodes, positions):
+        for node in nodes:
+            if node.fen is not None:
+                PositionIndex.addPosition(node.fen, positions)
+            PositionIndex.addTreePositions(node.children, positions)
+
+    @classmethod
+    def addPosition(cls, fen, positions):
+        # a position reached more than once in a variation is kept once, at its first ply
+        normalized = PositionIndex.normalizeFen(fen)
+        ply = PositionIndex.getPly(fen)
+        if normalized not in positions or ply < positions[normalized]:
+            positions[normalized] = ply
+
+    @classmethod
+    def find(cls, fen, courses=None):
+        # (courseId, chapter, round, variationId, name, ply) for every indexed variation that reaches fen, in course
+        # order.  fen can leave off the side to move and castling fields to match any of them
+        normalized = PositionIndex.normalizeFen(fen)
+        if len(normalized.split()) == 3:
+            where, args = "p.fen = ?", [normalized]
+        else:
+            # a range on the fen index - every fen that starts with these fields and a space
+            where, args = "p.fen >= ? AND p.fen < ?", [normalized + " ", normalized + "!"]
+        if courses:
+            where += " AND v.courseId IN (" + ", ".join("?" * len(courses)) + ")"
+            args += list(courses)
+        rows = PositionIndex.getConnection().execute(
+            "SELECT v.courseId, v.chapter, v.round, v.variationId, v.name, MIN(p.ply) FROM positions p JOIN "
+            "variations v ON v.id = p.variation WHERE " + where + " GROUP BY v.id", args).fetchall()
+        return sorted(rows, key=lambda r: (r[0], PositionIndex.getRoundKey(r[2])))
+
+    @classmethod
+    def getRoundKey(cls, roundStr):
+        # "12.3" sorts after "2.10" - one-off variations ("x.x") go last
+        return tuple(int(p) if p.isdigit() else float("inf") for p in roundStr.split("."))
+
+    @classmethod
+    def printMatches(cls, fen, courses=None):
+        if not os.path.exists(PositionIndex.getIndexFileName()):
+            print("- no position index at " + PositionIndex.getIndexFileName() + " - it's built as courses are rendered")
+            return 0
+        matches = PositionIndex.find(fen, courses)
+        print("--- " + str(len(matches)) + " variations reach " + PositionIndex.normalizeFen(fen) + " ---")
+        lastCourse = None
+        for courseId, chapter, roundStr, variationId, name, ply in matches:
+            if courseId != lastCourse:
+                print("- course " + courseId)
+                lastCourse = courseId
+            print("  " + roundStr + " " + chapter + " - " + name + " (variation " + variationId + ", ply " + str(ply) +
+                  ")")
+        return len(matches)
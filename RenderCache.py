@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Filename: RenderCache.py
+Author: John DeMastri
+Create Date: 2025-05-15
+Version: 0.1
+Description: Keeps the pgn rendered for each variation, keyed by a hash of everything that goes into it - the variation
+html, the pgn options, the header values and the renderer version.  If none of those changed since the last run, the
+pgn is read back instead of parsing and rendering the html again.  Entries live under <pgnRoot>/render/ and the least
+recently used ones are removed once the cache grows past RENDER_CACHE_MAX_MB.  MoveTree keeps its parsed trees here
+too, with getData / putData.
+
+License: MIT License
+Contact: chess@demastri.com
+"""
+import hashlib
+import os
+
+import ConfigData
+from Timing import Timing
+
+
+class RenderCache:
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def getRoot(cls):
+        return ConfigData.PGN_CACHE_PATH + "render/"
+
+    @classmethod
+    def getKey(cls, variationText, options):
+        # options is every other value that changes the output - see Pgn.createPgnFromText
+        h = hashlib.sha256()
+        for option in options:
+            h.update(str(option).encode('utf-8'))
+            h.update(b"\0")
+        h.update(variationText.encode('utf-8'))
+        return h.hexdigest()
+
+    @classmethod
+    def getFileName(cls, key, suffix=".pgn"):
+        return RenderCache.getRoot() + key[:2] + "/" + key + suffix
+
+    @classmethod
+    def get(cls, key):
+        fileName = RenderCache.getFileName(key)
+        try:
+            with open(fileName, "r", encoding='utf-8', newline='') as file:
+                pgnOut = file.read()
+        except OSError:
+            RenderCache.misses += 1
+            Timing.count("render cache miss")
+            return None
+        # touching the entry is what makes pruning least-recently-used
+        os.utime(fileName)
+        RenderCache.hits += 1
+        Timing.count("render cache hit")
+        return pgnOut
+
+    @classmethod
+    def put(cls, key, pgnOut):
+        fileName = RenderCache.getFileName(key)
+        os.makedirs(os.path.dirname(fileName), exist_ok=True)
+        # write then rename, so a reader (or a parallel render worker) never sees half an entry
+        tempName = fileName + "." + str(os.getpid()) + ".tmp"
+        with open(tempName, "w", encoding='utf-8', newline='') as file:
+            file.write(pgnOut)
+        os.replace(tempName, fileName)
+
+    @classmethod
+    def getData(cls, key, suffix):
+        # a binary entry, or None
+        fileName = RenderCache.getFileName(key, suffix)
+        try:
+            with open(fileName, "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+        os.utime(fileName)
+        return data
+
+    @classmethod
+    def putData(cls, key, data, suffix):
+        fileName = RenderCache.getFileName(key, suffix)
+        os.makedirs(os.path.dirname(fileName), exist_ok=True)
+        tempName = fileName + "." + str(os.getpid()) + ".tmp"
+        with open(tempName, "wb") as file:
+            file.write(data)
+        os.replace(tempName, fileName)
+
+    @classmethod
+    def prune(cls):
+        root = RenderCache.getRoot()
+        if not os.path.isdir(root):
+            return
+        entries = []
+        total = 0
+        for dirPath, dirNames, fileNames in os.walk(root):
+            for fileName in fileNames:
+                fullName = os.path.join(dirPath, fileName)
+                stat = os.stat(fullName)
+                entries.append((stat.st_mtime, stat.st_size, fullName))
+                total += stat.st_size
+        limit = ConfigData.RENDER_CACHE_MAX_MB * 1024 * 1024
+        if total <= limit:
+            return
+        # drop the oldest entries until we're comfortably under the limit
+        entries.sort()
+        removed = 0
+        for mtime, size, fullName in entries:
+            if total <= limit * 0.9:
+                break
+            os.remove(fullName)
+            total -= size
+            removed += 1
+        print("- pruned " + str(removed) + " render cache entries, " + str(total // (1024 * 1024)) + " MB left")
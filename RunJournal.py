@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Filename: RunJournal.py
+Author: John DeMastri
+Create Date: 2025-05-20
+Version: 0.1
+Description: Lets an interrupted incremental run pick up where it stopped.  While a course pgn is written variation by
+variation, a journal next to it (<courseID>.journal.jsonl) records each Round once it's in the file, with the size of
+the file at that point.  If the run dies, the next run of the same course (same variations, same pgn options) cuts the
+pgn back to the last recorded size and carries on with the following variation, leaving everything before it alone.
+A variation that couldn't be fetched is recorded as missing - if the next run can get it, the pgn is cut back to before
+it, so it gets another try instead of leaving a gap.  The journal is removed once the course is complete.
+
+License: MIT License
+Contact: chess@demastri.com
+"""
+import hashlib
+import json
+import os
+
+import ConfigData
+import Pgn as PgnModule
+from Pgn import Pgn
+
+JOURNAL_SUFFIX = ".journal.jsonl"
+
+
+class RunJournal:
+
+    @classmethod
+    def getFileName(cls, courseId):
+        return PgnModule.PGN_COURSE_PATH + courseId + JOURNAL_SUFFIX
+
+    @classmethod
+    def getPgnFileName(cls, courseId):
+        return PgnModule.PGN_COURSE_PATH + courseId + ".pgn"
+
+    @classmethod
+    def getRunKey(cls, courseId, variationTasks):
+        # anything that would make the pgn already written differ from what this run would write
+        h = hashlib.sha1()
+        h.update(json.dumps([PgnModule.RENDERER_VERSION, Pgn.PGN_WRITE_KEY_MOVE, ConfigData.HTML_PARSER,
+                             ConfigData.BASE_CHESSABLE_URL, courseId,
+                             [[v, r] for v, r, n in variationTasks]]).encode('utf-8'))
+        return h.hexdigest()
+
+    @classmethod
+    def start(cls, courseId, runKey):
+        os.makedirs(PgnModule.PGN_COURSE_PATH, exist_ok=True)
+        with open(RunJournal.getFileName(courseId), "w", encoding='utf-8') as file:
+            file.write(json.dumps({"courseId": courseId, "runKey": runKey}) + "\n")
+
+    @classmethod
+    def commit(cls, courseId, roundStr, variationId, missing=False):
+        # called once the variation's pgn is written and closed, so the size covers it.  missing if it had no html
+        offset = os.path.getsize(RunJournal.getPgnFileName(courseId))
+        entry = {"round": roundStr, "variationId": variationId, "offset": offset}
+        if missing:
+            entry["missing"] = True
+        with open(RunJournal.getFileName(courseId), "a", encoding='utf-8') as file:
+            file.write(json.dumps(entry) + "\n")
+
+    @classmethod
+    def finish(cls, courseId):
+        if os.path.exists(RunJournal.getFileName(courseId)):
+            os.remove(RunJournal.getFileName(courseId))
+
+    @classmethod
+    def resume(cls, courseId, runKey, canRetry=None):
+        # returns how many variations are already written (0 to start over), with the pgn cut back to match.
+        # canRetry(variationId) says whether a variation that was missing can be had this time - all of them if None
+        entries = RunJournal.loadJournal(courseId)
+        if entries is None or len(entries) < 2:
+            return 0
+        if entries[0].get("runKey") != runKey:
+            print("----- course " + courseId + " has changed since its last run was interrupted - starting over")
+            return 0
+        pgnFileName = RunJournal.getPgnFileName(courseId)
+        pgnSize = os.path.getsize(pgnFileName) if os.path.exists(pgnFileName) else -1
+        # the last variation whose pgn is all still in the file - anything written after it is cut off
+        committed = entries[1:]
+        while len(committed) > 0 and committed[-1]["offset"] > pgnSize:
+            committed.pop()
+        # a variation that was missing last time is tried again - along with everything after it, to keep Round order
+        gaps = [i for i, entry in enumerate(committed)
+                if entry.get("missing") and (canRetry is None or canRetry(entry["variationId"]))]
+        if len(gaps) > 0:
+            print("----- course " + courseId + " was missing round " + committed[gaps[0]]["round"] +
+                  " when its last run was interrupted - writing it again from there")
+            committed = committed[:gaps[0]]
+        if len(committed) == 0:
+            return 0
+        offset = committed[-1]["offset"]
+        with open(pgnFileName, "r+b") as file:
+            file.truncate(offset)
+        print("----- resuming course " + courseId + " after round " + committed[-1]["round"] + " (" +
+              str(len(committed)) + " variations already written)")
+        # the journal only keeps what's still in the file
+        with open(RunJournal.getFileName(courseId), "w", encoding='utf-8') as file:
+            for entry in entries[:1] + committed:
+                file.write(json.dumps(entry) + "\n")
+        return len(committed)
+
+    @classmethod
+    def loadJournal(cls, courseId):
+        if not os.path.exists(RunJournal.getFileName(courseId)):
+            return None
+        entries = []
+        with open(RunJournal.getFileName(courseId), "r", encoding='utf-8') as file:
+            for line in file:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break  # the run died while writing this line - nothing after it counts
+        return entries
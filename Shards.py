@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Filename: Shards.py
+Author: John DeMastri
+Create Date: 2025-05-23
+Version: 0.1
+Description: Splits a run across machines, each with its own logged in browser profile.  With -shard i/n a machine
+only fetches and renders its share of each course's variations - a variation belongs to the shard its id hashes to, so
+every machine agrees on the split without talking to the others.  Its pgn goes to a fragment file,
+<courseID>.shard-<i>-of-<n>.jsonl, one line per variation with its Round.  Once the fragments from every shard are in
+one pgn folder, -merge combines them (a k-way merge on Round) into <courseID>.pgn, in course order, exactly as a
+single machine would have written it.
+
+License: MIT License
+Contact: chess@demastri.com
+"""
+import glob
+import hashlib
+import heapq
+import json
+import os
+from pathlib import Path
+
+import ConfigData
+import Pgn as PgnModule
+from Pgn import Pgn
+from Timing import Timing
+
+FRAGMENT_SUFFIX = ".jsonl"
+
+
+class Shards:
+
+    @classmethod
+    def isSharded(cls):
+        return ConfigData.SHARD_COUNT > 1
+
+    @classmethod
+    def isInShard(cls, variationId, shardIndex=None, shardCount=None):
+        shardIndex = ConfigData.SHARD_INDEX if shardIndex is None else shardIndex
+        shardCount = ConfigData.SHARD_COUNT if shardCount is None else shardCount
+        # a hash rather than position, so the split doesn't depend on anything but the id
+        digest = hashlib.sha1(str(variationId).encode('utf-8')).hexdigest()
+        return int(digest, 16) % shardCount == shardIndex - 1
+
+    @classmethod
+    def getFragmentFileName(cls, courseId, shardIndex, shardCount):
+        return PgnModule.PGN_COURSE_PATH + courseId + ".shard-" + str(shardIndex) + "-of-" + str(shardCount) + \
+            FRAGMENT_SUFFIX
+
+    @classmethod
+    def writeFragment(cls, courseId, runKey, fragments):
+        # fragments yields (roundStr, variationId, pgn) in course order.  Like the course pgn, the fragment only
+        # replaces an earlier one once it's complete
+        Path(PgnModule.PGN_COURSE_PATH).mkdir(parents=True, exist_ok=True)
+        fileName = Shards.getFragmentFileName(courseId, ConfigData.SHARD_INDEX, ConfigData.SHARD_COUNT)
+        written = 0
+        with open(fileName + ".tmp", "w", encoding='utf-8') as file:
+            file.write(json.dumps({"courseId": courseId, "shard": ConfigData.SHARD_INDEX,
+                                   "shards": ConfigData.SHARD_COUNT, "runKey": runKey}) + "\n")
+            for roundStr, variationId, pgnOut in fragments:
+                with Timing.stage("pgn write"):
+                    file.write(json.dumps({"round": roundStr, "variationId": variationId, "pgn": pgnOut}) + "\n")
+                written += 1
+        os.replace(fileName + ".tmp", fileName)
+        print(" - " + str(written) + " variations written to " + fileName)
+        return written
+
+    @classmethod
+    def getRoundKey(cls, entry):
+        # "12.3" sorts after "2.10" - chapter, then variation, as numbers
+        return tuple(int(p) for p in entry["round"].split("."))
+
+    @classmethod
+    def iterFragment(cls, fileName):
+        with open(fileName, "r", encoding='utf-8') as file:
+            file.readline()  # the header
+            for line in file:
+                yield json.loads(line)
+
+    @classmethod
+    def readHeader(cls, fileName):
+        with open(fileName, "r", encoding='utf-8') as file:
+            return json.loads(file.readline())
+
+    @classmethod
+    def findFragments(cls, courseId):
+        # the fragment file for every shard of the course, or None (after saying why) if they don't add up.  Fragments
+        # left over from a run with a different shard count don't get in the way of a complete set
+        fileNames = sorted(glob.glob(glob.escape(PgnModule.PGN_COURSE_PATH + courseId) + ".shard-*-of-*" +
+                                     FRAGMENT_SUFFIX))
+        if len(fileNames) == 0:
+            print("- no shard fragments found for course " + courseId + " in " + PgnModule.PGN_COURSE_PATH)
+            return None
+        groups = {}  # shard count -> its fragments' headers
+        for fileName in fileNames:
+            header = Shards.readHeader(fileName)
+            groups.setdefault(header["shards"], []).append(header)
+
+        complete = []
+        for shardCount in sorted(groups):
+            headers = groups[shardCount]
+            missing = sorted(set(range(1, shardCount + 1)) - set(h["shard"] for h in headers))
+            if len(missing) > 0:
+                print("- course " + courseId + " is missing shard(s) " + ", ".join(str(i) for i in missing) +
+                      " of " + str(shardCount))
+            elif len(set(h["runKey"] for h in headers)) > 1:
+                print("- the " + str(shardCount) + " shard fragments for course " + courseId + " come from " +
+                      "different runs (course contents or pgn options differ) - run every shard again with the " +
+                      "same settings")
+            else:
+                complete.append(shardCount)
+        if len(complete) != 1:
+            if len(complete) > 1:
+                print("- course " + courseId + " has complete sets of " + " and ".join(str(n) for n in complete) +
+                      " shard fragments - remove the ones you don't want merged")
+            return None
+        shardCount = complete[0]
+        if len(groups) > 1:
+            print("- merging the " + str(shardCount) + " shard fragments for course " + courseId +
+                  " - ignoring fragments from runs with another shard count")
+        return [Shards.getFragmentFileName(courseId, i, shardCount) for i in range(1, shardCount + 1)]
+
+    @classmethod
+    def mergeCourse(cls, courseId):
+        fileNames = Shards.findFragments(courseId)
+        if fileNames is None:
+            return False
+        print("--- merging " + str(len(fileNames)) + " shards of course " + courseId + " ---")
+        # each fragment is already in course order, so a k-way merge on Round puts the whole course in order
+        merged = heapq.merge(*[Shards.iterFragment(fileName) for fileName in fileNames], key=Shards.getRoundKey)
+        Pgn.writeCoursePgnStream(courseId, (entry["pgn"] for entry in merged))
+        print("--- course " + courseId + " written to " + PgnModule.PGN_COURSE_PATH + courseId + ".pgn ---")
+        return True
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Filename: SyntheticHtml.py
+Author: John DeMastri
+Create Date: 2025-05-17
+Version: 0.1
+Description: Makes fake Chessable variation pages with the markup Pgn.buildMoveBody walks - whiteMove / blackMove divs
+for the main line, commentMoveSmall spans (data-san / data-fen) inside commentTopvar / commentSubvar variations,
+commentInVariation comments, annotation spans and an openingNum terminator.  The moves aren't legal chess, but the fen
+side to move and move numbers are consistent, which is all the renderer looks at.  Pages are repeatable - the same
+settings and variation id always give the same page - so they can be used to time and check the pgn engine without a
+browser, a login or a real html cache.
+
+License: MIT License
+Contact: chess@demastri.com
+"""
+import random
+
+STARTING_POSITION = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+SANS = ["e4", "d4", "Nf3", "c4", "e5", "d5", "Nc6", "Bb5", "a6", "O-O", "Qxd8+", "exd5", "g4", "h6", "Re1", "Rxe8#"]
+# symbols the renderer turns into nags, and some that it shouldn't
+MOVE_SUFFIXES = ["!", "?", "!?", "?!", "±", "+-", "="]
+WORDS = ["the", "idea", "is", "to", "play", "for", "a", "break", "with", "pressure", "on", "centre", "white", "black",
+         "keeps", "an", "edge", "after", "but", "here"]
+TERMINATORS = ["*", "1-0", "0-1", "1/2-1/2"]
+
+
+class SyntheticHtml:
+    def __init__(self, seed=0, moves=40, depth=4, variationDensity=0.3, commentDensity=0.2, commentWords=6,
+                 annotationDensity=0.1):
+        self.seed = seed
+        self.moves = moves  # main line length, in plies
+        self.depth = depth  # how deep variations can nest inside each other
+        self.variationDensity = variationDensity  # chance of a variation after any move
+        self.commentDensity = commentDensity  # chance of a comment before any move
+        self.commentWords = commentWords  # comments have up to this many words
+        self.annotationDensity = annotationDensity  # chance of a !/? style symbol on any move
+
+    def makeCorpus(self, count, courseId="synthetic"):
+        # (courseId, variationId, html) for count pages
+        return [(courseId, str(1000 + i), self.makePage(1000 + i)) for i in range(count)]
+
+    def makePage(self, variationId):
+        r = random.Random(self.seed * 1000003 + variationId)
+        startPly = 0 if variationId % 7 else 6
+        body = []
+        for ply in range(startPly, startPly + self.moves):
+            moveClass = "whiteMove" if ply % 2 == 0 else "blackMove"
+            key = " is_key" if r.random() < 0.1 else ""
+            body.append('<span><div class="%s%s" data-move="%d." data-san="%s" data-fen="%s">%s</div></span>' %
+                        (moveClass, key, ply // 2 + 1, r.choice(SANS), self.getFen(ply + 1), r.choice(SANS)))
+            if r.random() < self.annotationDensity:
+                body.append('<span class="annotation" data-original-title="Good move">%s</span>' %
+                            r.choice(MOVE_SUFFIXES))
+            if r.random() < self.variationDensity or r.random() < self.commentDensity:
+                comment = '<span class="commentInVariation">%s</span>' % self.makeComment(r) \
+                    if r.random() < 0.5 else ""
+                # now and then a continuation rather than an alternative, which the renderer has to patch up
+                variation = '<span class="commentTopvar">%s</span>' % self.makeVariation(
+                    r, ply + (1 if r.random() < 0.1 else 0), 1) if r.random() < self.variationDensity else ""
+                body.append('<span class="commentMove">%s%s</span>' % (comment, variation))
+        if r.random() < 0.3:
+            # a trailing variation and comment - what the chessbase workarounds are for
+            body.append('<span class="commentMove"><span class="commentTopvar">%s</span>'
+                        '<span class="commentInVariation">%s</span></span>' %
+                        (self.makeVariation(r, startPly + self.moves - 1, 1), self.makeComment(r)))
+        terminator = '<div class="openingNum">%s</div>' % r.choice(TERMINATORS) if r.random() < 0.5 else ""
+        return ('<html><head><title>Variation %d - Chessable</title></head><body>'
+                '<div id="theOpeningTitle">Variation, %d</div>'
+                '<div class="allOpeningDetails"><ul><li>Synthetic Course</li><li>by</li><li>Chapter, %d</li></ul></div>'
+                '<input id="inputFEN" value="%s"><div id="theOpeningMoves">%s%s</div></body></html>') % (
+            variationId, variationId, variationId % 5, STARTING_POSITION if startPly == 0 else self.getFen(startPly),
+            "".join(body), terminator)
+
+    def makeVariation(self, r, ply, depth):
+        # an alternative to the move played at ply - so it starts with the same side to move
+        out = []
+        for k in range(r.randint(1, 8)):
+            if r.random() < self.commentDensity:
+                out.append('<span class="commentInVariation">%s</span>' % self.makeComment(r))
+            suffix = r.choice(MOVE_SUFFIXES) if r.random() < self.annotationDensity else ""
+            san = r.choice(SANS)
+            out.append('<span class="commentMoveSmall" data-san="%s" data-fen="%s">%s%s</span>' %
+                       (san, self.getFen(ply + k + 1), san, suffix))
+            # deeper variations get rarer, or deep settings would make pages that grow exponentially
+            if depth < self.depth and r.random() < self.variationDensity / depth:
+                out.append('<span class="%s">%s</span>' % (r.choice(["commentTopvar", "commentSubvar"]),
+                                                           self.makeVariation(r, ply + k, depth + 1)))
+        return "".join(out)
+
+    def makeComment(self, r):
+        words = [r.choice(WORDS) for i in range(r.randint(1, self.commentWords))]
+        if r.random() < 0.2:
+            # a number at the end of a comment is one of the things chessbase gets wrong
+            words.append(str(r.randint(1, 40)))
+        return " ".join(words)
+
+    @classmethod
+    def getFen(cls, ply):
+        # the position after ply half moves - only the side to move and the move number matter to the renderer
+        return "8/8/8/8/8/8/8/8 %s - - 0 %d" % ("b" if ply % 2 else "w", ply // 2 + 1)
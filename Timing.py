@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Filename: Timing.py
+Author: John DeMastri
+Create Date: 2025-05-19
+Version: 0.1
+Description: Where the time goes in a run.  The stages WebFetch and Pgn go through (browser launch, page load, waiting
+for the page, reading the cache, parsing, rendering, writing) are timed with Timing.stage(), and things worth counting
+(cache hits and misses, fetch retries) with Timing.count().  Each run writes these as json lines to
+TIMING_LOG_PATH/run-<date>-<time>.jsonl - worker processes add to the same file - and ends with a summary of the
+totals and p50 / p95 per stage, and the counts.
+
+License: MIT License
+Contact: chess@demastri.com
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import ConfigData
+
+
+class Timing:
+    # this process's numbers - the summary reads the log instead when there is one, so worker processes are included
+    stageTimes = {}
+    counts = {}
+
+    logName = None  # set for the run by startRun(), and handed to worker processes
+    logFile = None
+    logPid = None
+    # fetchAhead's thread logs alongside the main thread - one of them opens the log, and lines don't interleave
+    logLock = threading.Lock()
+
+    @classmethod
+    def startRun(cls):
+        Timing.stageTimes = {}
+        Timing.counts = {}
+        Timing.closeLog()
+        Timing.logName = None
+        if ConfigData.TIMING_LOG:
+            os.makedirs(ConfigData.TIMING_LOG_PATH, exist_ok=True)
+            Timing.logName = ConfigData.TIMING_LOG_PATH + "run-" + datetime.now().strftime("%Y%m%d-%H%M%S") + ".jsonl"
+
+    @classmethod
+    @contextlib.contextmanager
+    def stage(cls, name, detail=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            Timing.recordStage(name, time.perf_counter() - start, detail)
+
+    @classmethod
+    def recordStage(cls, name, seconds, detail=None):
+        Timing.stageTimes.setdefault(name, []).append(seconds)
+        event = {"stage": name, "seconds": round(seconds, 6)}
+        if detail is not None:
+            event["detail"] = detail
+        Timing.writeEvent(event)
+
+    @classmethod
+    def count(cls, name, detail=None):
+        Timing.counts[name] = Timing.counts.get(name, 0) + 1
+        event = {"count": name}
+        if detail is not None:
+            event["detail"] = detail
+        Timing.writeEvent(event)
+
+    @classmethod
+    def writeEvent(cls, event):
+        if Timing.logName is None:
+            return
+        with Timing.logLock:
+            # each process opens the log for itself - a file handle inherited from a parent process isn't safe to share
+            if Timing.logFile is None or Timing.logPid != os.getpid():
+                Timing.logFile = open(Timing.logName, "a", encoding='utf-8', buffering=1)
+                Timing.logPid = os.getpid()
+            event["time"] = round(time.time(), 3)
+            event["pid"] = Timing.logPid
+            Timing.logFile.write(json.dumps(event) + "\n")
+
+    @classmethod
+    def closeLog(cls):
+        with Timing.logLock:
+            if Timing.logFile is not None and Timing.logPid == os.getpid():
+                Timing.logFile.close()
+            Timing.logFile = None
+            Timing.logPid = None
+
+    @classmethod
+    def resetLock(cls):
+        # a forked worker starts with only the thread that forked it - the lock may have been held by another one
+        Timing.logLock = threading.Lock()
+
+    @classmethod
+    def readLog(cls):
+        stageTimes = {}
+        counts = {}
+        with open(Timing.logName, "r", encoding='utf-8') as file:
+            for line in file:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue  # a worker that was killed mid-line
+                if "stage" in event:
+                    stageTimes.setdefault(event["stage"], []).append(event["seconds"])
+                elif "count" in event:
+                    counts[event["count"]] = counts.get(event["count"], 0) + 1
+        return stageTimes, counts
+
+    @classmethod
+    def getPercentile(cls, sortedTimes, percent):
+        return sortedTimes[min(len(sortedTimes) - 1, int(round(percent / 100 * (len(sortedTimes) - 1))))]
+
+    @classmethod
+    def printSummary(cls):
+        stageTimes, counts = Timing.stageTimes, Timing.counts
+        if Timing.logName is not None and os.path.exists(Timing.logName):
+            if Timing.logFile is not None:
+                Timing.logFile.flush()
+            stageTimes, counts = Timing.readLog()
+        if len(stageTimes) == 0 and len(counts) == 0:
+            return
+        print("--- timing" + ("" if Timing.logName is None else " (events in " + Timing.logName + ")") + " ---")
+        print(f"{'stage':<20} {'count':>7} {'total s':>9} {'p50 ms':>9} {'p95 ms':>9}")
+        for name, times in stageTimes.items():
+            times = sorted(times)
+            print(f"{name:<20} {len(times):>7} {sum(times):>9.2f} {1000 * Timing.getPercentile(times, 50):>9.1f} "
+                  f"{1000 * Timing.getPercentile(times, 95):>9.1f}")
+        if len(counts) > 0:
+            print("- " + ", ".join(name + ": " + str(n) for name, n in sorted(counts.items())))
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=Timing.resetLock)
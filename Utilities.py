@@ -31,6 +31,15 @@ def getOpenOption(i, paramName):
     print("- Setting " + paramName + " to <" + thisParam + ">")
     return thisParam
 
+def getIntOption(i, paramName):
+    thisParam = getOpenOption(i, paramName)
+    if thisParam is None:
+        return None
+    if not is_integer(thisParam) or int(thisParam) < 1:
+        print("- Invalid argument <" + thisParam + "> provided for " + paramName + ".  Exiting.")
+        return None
+    return int(thisParam)
+
 def is_integer(str_val):
     try:
         int(str_val)
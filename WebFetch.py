@@ -14,30 +14,95 @@ actual course content from variations is handled in Pgn.py.
 License: MIT License
 Contact: chess@demastri.com
 """
+import atexit
 import os.path
+import re
 from pathlib import Path
 import bs4
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver import ActionChains
 from bs4 import BeautifulSoup
 import time
 
 from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.wait import WebDriverWait
 
 import ConfigData
+from FetchScheduler import FetchScheduler
+from HtmlStore import HtmlStore
+from HttpFetch import HttpFetch
+from Timing import Timing
+
+# the only parts of a variation page that getVariationParts reads
+VARIATION_PART_STARTS = [re.compile(r'<div\b[^>]*\bid="theOpeningTitle"'),
+                         re.compile(r'<div\b[^>]*\bclass="(?:[^"]*\s)?allOpeningDetails[\s"]'),
+                         re.compile(r'<div\b[^>]*\bid="theOpeningMoves"'),
+                         re.compile(r'<input\b[^>]*\bid="inputFEN"')]
+DIV_TAG = re.compile(r'<(/?)div\b')
+# the markup pageReadySelectors waits for in the browser, found in raw html without parsing the page
+PAGE_READY_MARKERS = {"course": re.compile(r'<div\b[^>]*\bclass="(?:[^"]*\s)?chapter[\s"]'),
+                      "chapter": re.compile(r'<div\b[^>]*\bclass="(?:[^"]*\s)?variation-card__row--main[\s"]'),
+                      "variation": re.compile(r'<[a-zA-Z][^>]*\bid="theOpeningMoves"')}
+SIDECAR_SUFFIX = ".parts.html"
 
 
 class WebFetch:
     FETCH_NEW = 0
     FETCH_ALL = 1
     FETCH_NONE = 2
-    flagNames = ["update", "all", "none"]
+    FETCH_REFRESH = 3
+    flagNames = ["update", "all", "none", "refresh"]
+    # page types FETCH_REFRESH always fetches again - they list what's in a course.  Anything else is fetched if it's new
+    refreshPageTypes = ["course", "chapter"]
 
     doFetch = FETCH_NEW
 
+    # one browser session is kept open across page loads - launching chrome is a big part of the per-page cost
+    browser = None
+    browserProfile = None
+    browserPages = 0
+    # builds the browser session from a profile name.  None means Chrome for Testing as set up in ConfigData - a
+    # stand-in with the same webdriver calls (like MockChessable.FakeDriver) can be plugged in here
+    driverFactory = None
+
+    # launch vs navigation cost, reported by printFetchStats()
+    launchCount = 0
+    launchTime = 0.0
+    navigateCount = 0
+    navigateTime = 0.0
+
+    # markup that has to be on each type of page before it's worth reading (timeouts are in ConfigData)
+    pageReadySelectors = {"course": "div.chapter",
+                          "chapter": "div.variation-card__row--main",
+                          "variation": "#theOpeningMoves"}
+    # how pages can be fetched - each takes (url, profileName, pageType) and returns the page, or None if it couldn't.
+    # FETCH_BACKENDS in ConfigData picks one per page type.  Anything other than selenium falls back to it
+    fetchBackendNames = ["selenium", "http"]
+    # seconds from browser.get() until each page type was ready, reported by printFetchStats()
+    pageLatencies = {}
+    latencyBuckets = [0.5, 1, 2, 4, 8, 16, 32]
+
+    # bs4 tree builders that can parse cached pages, set with -parser / HTML_PARSER
+    parserNames = ["html.parser", "lxml", "html5lib"]
+    # where cached pages live, set with -cache / HTML_CACHE_BACKEND - one file per page, or packed into HtmlStore
+    cacheNames = ["files", "packed"]
+
+    # pages already fetched from the web during this run (here or by a worker) - FETCH_ALL won't pull them again
+    fetchedThisRun = set()
+    # pages that couldn't be fetched again this run, so the cached copy was used - they may be out of date
+    refetchFailed = set()
+
     def __init__(self):
         WebFetch.doFetch = WebFetch.FETCH_NEW
 
+    @classmethod
+    def startRun(cls):
+        # a batch in interactive mode is a run of its own - pages fetched by an earlier one are refetched if asked
+        WebFetch.fetchedThisRun = set()
+        WebFetch.refetchFailed = set()
+
     @classmethod
     def getCourseDetail(cls, courseId: str, profileName: str):
         # should return a map of chapter IDs and chapter names
@@ -66,14 +131,20 @@ class WebFetch:
 
     @classmethod
     def getChapterDetail(cls, courseId: str, chapterBs: bs4.element.Tag, profileName: str):
-        href = chapterBs.find('a', href=True)['href']
-        tags = href.split('/')
-        chapterID = tags[len(tags) - 1]
+        chapterID = WebFetch.getChapterIdFromTag(chapterBs)
         bs = WebFetch.getChapterHtml(courseId, chapterID, profileName)
+        if bs is None:
+            return None, []
         variations = WebFetch.getChapterVariations(bs)
 
         return bs, variations
 
+    @classmethod
+    def getChapterIdFromTag(cls, chapterBs: bs4.element.Tag):
+        href = chapterBs.find('a', href=True)['href']
+        tags = href.split('/')
+        return tags[len(tags) - 1]
+
     @classmethod
     def getCourseChapters(cls, bs: BeautifulSoup):
         chapters = bs.find_all("div", class_="chapter")
@@ -97,24 +168,103 @@ class WebFetch:
         return name
 
     @classmethod
-    def getVariationDetailFromTag(cls, courseId: str, variationBs: bs4.element.Tag, profileName: str):
-        name = variationBs.find('a', href=True).text
+    def getVariationIdFromTag(cls, variationBs: bs4.element.Tag):
         href = variationBs.find('a', href=True)['href']
         tags = href.split('/')
-        variationID = tags[len(tags) - 2]
+        return tags[len(tags) - 2]
+
+    @classmethod
+    def getVariationNameFromTag(cls, variationBs: bs4.element.Tag):
+        return variationBs.find('a', href=True).text
+
+    @classmethod
+    def getVariationDetail(cls, courseId: str, variationID: str, name: str, profileName: str):
         print("Getting Variation Detail '" + courseId + "-" + variationID + "-" + name + "'")
-        bs = WebFetch.getVariationHtml(variationID, courseId, profileName)
+        variationText = WebFetch.getVariationText(variationID, courseId, profileName)
 
-        return [bs, variationID]
+        return [variationText, variationID]
 
     @classmethod
     def getVariationDetailFromId(cls, courseId: str, variationID: str, profileName: str):
-        bs = WebFetch.getVariationHtml(variationID, courseId, profileName)
-        return [bs, variationID]
+        variationText = WebFetch.getVariationText(variationID, courseId, profileName)
+        return [variationText, variationID]
 
     @classmethod
     def getVariationHtml(cls, variationId: str, courseId: str, profileName: str):
-        return WebFetch.getHtml("variation", variationId, profileName, "course/" + str(courseId), True)
+        variationText = WebFetch.getVariationText(variationId, courseId, profileName)
+        return None if variationText is None else WebFetch.parseHtml(variationText)
+
+    @classmethod
+    def getVariationText(cls, variationId: str, courseId: str, profileName: str):
+        # the html pgn is built from, unparsed - the whole page, or with VARIATION_EXTRACT just the parts we use
+        if not ConfigData.VARIATION_EXTRACT:
+            return WebFetch.fetchVariationHtml(variationId, courseId, profileName)
+
+        # only build a tree for the parts of the page we use, and if asked, keep them next to the page for next time
+        location = WebFetch.getVariationLocation(variationId, courseId)
+        if not WebFetch.isRefetch(location, "variation") and WebFetch.isSidecarFresh(location):
+            return WebFetch.loadHtmlFromFile(location, SIDECAR_SUFFIX)
+        pageHtml = WebFetch.fetchVariationHtml(variationId, courseId, profileName)
+        if pageHtml is None:
+            return None
+        with Timing.stage("extract"):
+            partsHtml = WebFetch.extractVariationParts(pageHtml)
+        if ConfigData.VARIATION_SIDECAR and partsHtml is not pageHtml:
+            WebFetch.writeHtmlToFile(location, partsHtml, SIDECAR_SUFFIX)
+        return partsHtml
+
+    @classmethod
+    def extractVariationParts(cls, pageHtml):
+        # cut the title, details, moves and start position out of the raw page without parsing all of it.
+        # returns the page unchanged if any part can't be found, so the normal parse (and error reporting) still happens
+        spans = []
+        for partStart in VARIATION_PART_STARTS:
+            found = partStart.search(pageHtml)
+            if found is None:
+                return pageHtml
+            start = found.start()
+            if pageHtml.startswith("<input", start):
+                end = pageHtml.find(">", found.end()) + 1
+            else:
+                end = 0
+                depth = 0
+                for tag in DIV_TAG.finditer(pageHtml, start):
+                    depth += -1 if tag.group(1) else 1
+                    if depth == 0:
+                        end = pageHtml.find(">", tag.end()) + 1
+                        break
+            if end <= 0:
+                return pageHtml
+            spans.append((start, end))
+        spans.sort()
+        parts = []
+        lastEnd = -1
+        for start, end in spans:
+            if start >= lastEnd:  # skip a part that's nested in one we already have
+                parts.append(pageHtml[start:end])
+                lastEnd = end
+        return "<html><body>\n" + "\n".join(parts) + "\n</body></html>"
+
+    @classmethod
+    def isSidecarFresh(cls, location):
+        # a sidecar is only good while its page is cached and hasn't been rewritten since
+        if ConfigData.HTML_CACHE_BACKEND == "packed":
+            pageTime = HtmlStore.getStoredTime(location + ".html")
+            sidecarTime = HtmlStore.getStoredTime(location + SIDECAR_SUFFIX)
+            return pageTime is not None and sidecarTime is not None and sidecarTime >= pageTime
+        pageFile = WebFetch.getCacheFileName(location)
+        sidecarFile = WebFetch.getCacheFileName(location, SIDECAR_SUFFIX)
+        return (os.path.exists(sidecarFile) and os.path.exists(pageFile) and
+                os.path.getmtime(sidecarFile) >= os.path.getmtime(pageFile))
+
+    @classmethod
+    def fetchVariationHtml(cls, variationId: str, courseId: str, profileName: str):
+        # same as getVariationHtml, but leaves the page as text - for callers that only need it cached
+        return WebFetch.fetchHtml("variation", variationId, profileName, "course/" + str(courseId), "variation")
+
+    @classmethod
+    def getVariationLocation(cls, variationId: str, courseId: str):
+        return WebFetch.getLocation("variation", variationId, "course/" + str(courseId))
 
     @classmethod
     def getVariationParts(cls, variationBs: bs4.element.Tag):
@@ -133,82 +283,346 @@ class WebFetch:
 
     @classmethod
     def getChapterHtml(cls, courseId: str, chapterId: str, profileName):
-        return WebFetch.getHtml("course", courseId + "/" + chapterId, profileName)
+        return WebFetch.getHtml("course", courseId + "/" + chapterId, profileName, pageType="chapter")
 
     @classmethod
     def getCourseHtml(cls, courseId: str, profileName: str):
         return WebFetch.getHtml("course", courseId, profileName)
 
     @classmethod
-    def getHtml(cls, elementType, elementId: str, profileName: str, fileroot="", isVar=False):
+    def getLocation(cls, elementType, elementId: str, fileroot=""):
         location = elementType
         if elementId != "":
             location += "/" + elementId
-        url = ConfigData.BASE_CHESSABLE_URL + location
         if fileroot != "":
             location = fileroot + "/" + location
+        return location
+
+    @classmethod
+    def isRefetch(cls, location, pageType):
+        # will this page be fetched from the web even though it may already be cached?
+        if location in WebFetch.fetchedThisRun or location in FetchScheduler.gaveUp:
+            return False
+        return WebFetch.doFetch == WebFetch.FETCH_ALL or (
+                WebFetch.doFetch == WebFetch.FETCH_REFRESH and pageType in WebFetch.refreshPageTypes)
+
+    @classmethod
+    def getHtml(cls, elementType, elementId: str, profileName: str, fileroot="", pageType="course"):
+        pageHtml = WebFetch.fetchHtml(elementType, elementId, profileName, fileroot, pageType)
+        bs = None if pageHtml is None else WebFetch.parseHtml(pageHtml)
+        return bs
 
-        # don't bother checking if we're overwriting all
+    @classmethod
+    def parseHtml(cls, pageHtml, parser=None):
+        # every page goes through here, so the accessors above see the same tree whichever backend built it
+        with Timing.stage("parse"):
+            return BeautifulSoup(pageHtml, ConfigData.HTML_PARSER if parser is None else parser)
+
+    @classmethod
+    def isParserAvailable(cls, parser):
+        try:
+            BeautifulSoup("", parser)
+            return True
+        except bs4.FeatureNotFound:
+            return False
+
+    @classmethod
+    def fetchHtml(cls, elementType, elementId: str, profileName: str, fileroot="", pageType="course"):
+        url = ConfigData.BASE_CHESSABLE_URL + WebFetch.getLocation(elementType, elementId)
+        location = WebFetch.getLocation(elementType, elementId, fileroot)
+
+        # don't bother checking if we're overwriting all (unless we already did it this run)
         # if the file already exists, load it
-        if WebFetch.doFetch == WebFetch.FETCH_ALL:
-            pageHtml = WebFetch.loadHtmlFromWeb(url, profileName)
-            WebFetch.writeHtmlToFile(location, pageHtml)
+        if WebFetch.isRefetch(location, pageType):
+            Timing.count("html refetched")
+            pageHtml = WebFetch.loadHtmlFromWeb(url, profileName, pageType)
+            if pageHtml is None:
+                # a page we already have is better than none - the run carries on with the cached copy, and the page
+                # still gets another try at the end of the run
+                cachedHtml = WebFetch.loadHtmlFromFile(location)
+                if len(cachedHtml) > 0:
+                    print("-- couldn't fetch " + location + " again - using the cached copy")
+                    Timing.count("refetch failed, cache used", pageType)
+                    WebFetch.markRefetchFailed(location, pageType)
+                    return cachedHtml
         else:
             pageHtml = WebFetch.loadHtmlFromFile(location)
+            Timing.count("html cache hit" if len(pageHtml) > 0 else "html cache miss")
+            if len(pageHtml) > 0:
+                return pageHtml
             # otherwise get it from the web
-            if len(pageHtml) == 0:
-                if WebFetch.doFetch == WebFetch.FETCH_NONE:
-                    return None
-                # else doFetch == FETCH_NEW
-                pageHtml = WebFetch.loadHtmlFromWeb(url, profileName, isVar)
-                WebFetch.writeHtmlToFile(location, pageHtml)
-
-        bs = None if pageHtml is None else BeautifulSoup(pageHtml, 'html.parser')
-        return bs
+            if WebFetch.doFetch == WebFetch.FETCH_NONE or location in FetchScheduler.gaveUp:
+                return None
+            # else doFetch == FETCH_NEW, or FETCH_REFRESH for a new variation
+            pageHtml = WebFetch.loadHtmlFromWeb(url, profileName, pageType)
+
+        # a failed page leaves the cache as it was, and gets another try at the end of the run
+        if pageHtml is None:
+            print("-- returned no content from web")
+            WebFetch.queueRetry(location, pageType)
+            return None
+        WebFetch.writeHtmlToFile(location, pageHtml)
+        WebFetch.fetchedThisRun.add(location)
+        return pageHtml
 
     @classmethod
-    def loadHtmlFromFile(self, location):
-        if not os.path.exists(ConfigData.HTML_CACHE_PATH + location + ".html"):
-            return ""
-        with open(ConfigData.HTML_CACHE_PATH + location + ".html", "r", encoding='utf-8') as file:
-            return file.read()
+    def getUrl(cls, location):
+        # cached pages live under a course (course/<courseID>/variation/<variationID>), the site doesn't
+        if "/variation/" in location:
+            return ConfigData.BASE_CHESSABLE_URL + location[location.index("variation/"):]
+        return ConfigData.BASE_CHESSABLE_URL + location
 
     @classmethod
-    def writeHtmlToFile(self, location, content):
-        path = Path(ConfigData.HTML_CACHE_PATH + location[:location.rfind("/")])
-        path.mkdir(parents=True, exist_ok=True)
-        with open(ConfigData.HTML_CACHE_PATH + location + ".html", "w", encoding='utf-8') as file:
-            if content is None:
-                print("-- returned no content from web")
-            else:
+    def queueRetry(cls, location, pageType):
+        FetchScheduler.queueRetry(location, WebFetch.getUrl(location), pageType)
+
+    @classmethod
+    def markRefetchFailed(cls, location, pageType):
+        # the cached copy stands in for the page for the rest of the run - it isn't fetched again until the retries
+        WebFetch.refetchFailed.add(location)
+        WebFetch.fetchedThisRun.add(location)
+        WebFetch.queueRetry(location, pageType)
+
+    @classmethod
+    def retryFailedFetches(cls, profileName):
+        # pages that failed every attempt earlier in the run get one more go.  Returns the locations now cached
+        # (one the run went on to fetch anyway - like a page a worker failed on - doesn't need it)
+        retries = [r for r in FetchScheduler.takeRetries()
+                   if r[0] not in WebFetch.fetchedThisRun or r[0] in WebFetch.refetchFailed]
+        if len(retries) == 0:
+            return []
+        print("--- retrying " + str(len(retries)) + " pages that failed earlier in the run ---")
+        fetched = []
+        for location, url, pageType in retries:
+            pageHtml = WebFetch.loadHtmlFromWeb(url, profileName, pageType)
+            if pageHtml is None:
+                print(" - giving up on <" + url + ">")
+                FetchScheduler.gaveUp.add(location)
+                continue
+            WebFetch.writeHtmlToFile(location, pageHtml)
+            WebFetch.fetchedThisRun.add(location)
+            WebFetch.refetchFailed.discard(location)
+            fetched.append(location)
+        print("--- " + str(len(fetched)) + " of " + str(len(retries)) + " pages fetched on retry ---")
+        return fetched
+
+    @classmethod
+    def isCached(cls, location):
+        if ConfigData.HTML_CACHE_BACKEND == "packed":
+            return HtmlStore.exists(location + ".html")
+        fileName = WebFetch.getCacheFileName(location)
+        return os.path.exists(fileName) and os.path.getsize(fileName) > 0
+
+    @classmethod
+    def getCacheFileName(cls, location, suffix=".html"):
+        return ConfigData.HTML_CACHE_PATH + location + suffix
+
+    @classmethod
+    def loadHtmlFromFile(self, location, suffix=".html"):
+        with Timing.stage("html read"):
+            if ConfigData.HTML_CACHE_BACKEND == "packed":
+                return HtmlStore.read(location + suffix)
+            if not os.path.exists(WebFetch.getCacheFileName(location, suffix)):
+                return ""
+            with open(WebFetch.getCacheFileName(location, suffix), "r", encoding='utf-8') as file:
+                return file.read()
+
+    @classmethod
+    def writeHtmlToFile(self, location, content, suffix=".html"):
+        with Timing.stage("html write"):
+            if ConfigData.HTML_CACHE_BACKEND == "packed":
+                HtmlStore.write(location + suffix, content)
+                return
+            path = Path(ConfigData.HTML_CACHE_PATH + location[:location.rfind("/")])
+            path.mkdir(parents=True, exist_ok=True)
+            with open(WebFetch.getCacheFileName(location, suffix), "w", encoding='utf-8') as file:
                 file.write(content)
 
     @classmethod
-    def loadHtmlFromWeb(self, url, profileName, isVar=False):
-        # print("Reading "+url+" using "+profileName)
-        for retry in range(3):
-            try:
+    def listCachedLocations(cls, prefix, suffix=".html"):
+        # locations of all cached pages under prefix (like "course/24575/variation/"), in sorted order
+        if ConfigData.HTML_CACHE_BACKEND == "packed":
+            keys = HtmlStore.listKeys(prefix)
+        else:
+            folder = ConfigData.HTML_CACHE_PATH + prefix
+            keys = [] if not os.path.isdir(folder) else sorted(prefix + f for f in os.listdir(folder))
+        # only pages directly under prefix, and not sidecars (which share the page's suffix)
+        return [k[:-len(suffix)] for k in keys
+                if k.endswith(suffix) and "/" not in k[len(prefix):] and "." not in k[len(prefix):-len(suffix)]]
+
+    @classmethod
+    def getCachedSize(cls, location):
+        if ConfigData.HTML_CACHE_BACKEND == "packed":
+            return HtmlStore.getSize(location + ".html")
+        return os.path.getsize(WebFetch.getCacheFileName(location))
+
+    @classmethod
+    def getBrowser(cls, profileName):
+        # reuse the open session unless it's for a different profile or has served its quota of pages
+        if WebFetch.browser is not None and (WebFetch.browserProfile != profileName or
+                                             WebFetch.browserPages >= ConfigData.BROWSER_RECYCLE_PAGES):
+            WebFetch.closeBrowser()
+        if WebFetch.browser is None:
+            start = time.perf_counter()
+            if WebFetch.driverFactory is not None:
+                WebFetch.browser = WebFetch.driverFactory(profileName)
+            else:
                 options = webdriver.ChromeOptions()
                 options.add_argument('headless')
                 options.binary_location = ConfigData.CHROME_FOR_TESTING_BINARY_LOC
                 options.add_argument('--user-data-dir=' + ConfigData.TESTING_PROFILE_BASE_DIR)
                 options.add_argument('--profile-directory=' + profileName)  # TESTING_PROFILE)
-                browser = webdriver.Chrome(options=options)
-                browser.get(url)
-                time.sleep(2)
-                if isVar:
-                    controls = browser.find_element(By.ID, "controls")
-                    buttons = controls.find_elements(By.TAG_NAME, "button")
-                    backClass = buttons[1].get_attribute("class")
-                    if not "myButtonOff" in backClass:
-                        buttons[1].click()
-                        time.sleep(1)
-                outText = browser.page_source
-                browser.quit()
+                WebFetch.browser = webdriver.Chrome(options=options)
+            WebFetch.browserProfile = profileName
+            WebFetch.browserPages = 0
+            WebFetch.launchCount += 1
+            WebFetch.launchTime += time.perf_counter() - start
+            Timing.recordStage("browser launch", time.perf_counter() - start)
+        return WebFetch.browser
+
+    @classmethod
+    def closeBrowser(cls):
+        if WebFetch.browser is None:
+            return
+        try:
+            WebFetch.browser.quit()
+        except Exception as e:
+            exception_message = e.args[0] if e.args else "No message"
+            print(f"error closing browser : {exception_message}")
+        WebFetch.browser = None
+        WebFetch.browserProfile = None
+        WebFetch.browserPages = 0
+
+    @classmethod
+    def printFetchStats(cls):
+        if WebFetch.launchCount == 0 and WebFetch.navigateCount == 0:
+            return
+        launchAvg = WebFetch.launchTime / WebFetch.launchCount if WebFetch.launchCount > 0 else 0.0
+        navigateAvg = WebFetch.navigateTime / WebFetch.navigateCount if WebFetch.navigateCount > 0 else 0.0
+        print(f"- browser launches: {WebFetch.launchCount} taking {WebFetch.launchTime:.1f}s ({launchAvg:.2f}s avg)")
+        print(f"- page loads: {WebFetch.navigateCount} taking {WebFetch.navigateTime:.1f}s ({navigateAvg:.2f}s avg)")
+        for pageType, latencies in WebFetch.pageLatencies.items():
+            counts = [0] * (len(WebFetch.latencyBuckets) + 1)
+            for latency in latencies:
+                bucket = 0
+                while bucket < len(WebFetch.latencyBuckets) and latency > WebFetch.latencyBuckets[bucket]:
+                    bucket += 1
+                counts[bucket] += 1
+            labels = ["<=" + str(b) + "s" for b in WebFetch.latencyBuckets] + [">" + str(WebFetch.latencyBuckets[-1]) + "s"]
+            print("-- " + pageType + " ready after: " + ", ".join(
+                labels[b] + ": " + str(counts[b]) for b in range(len(counts)) if counts[b] > 0))
+
+    @classmethod
+    def isBackButtonOff(cls, browser):
+        buttons = browser.find_element(By.ID, "controls").find_elements(By.TAG_NAME, "button")
+        return len(buttons) > 1 and "myButtonOff" in buttons[1].get_attribute("class")
+
+    @classmethod
+    def waitUntilReady(cls, browser, pageType):
+        # wait for the page's own content rather than a fixed time - returns as soon as it's there,
+        # raises TimeoutException (and so retries) if it never shows up
+        timeout = ConfigData.PAGE_READY_TIMEOUTS[pageType]
+        WebDriverWait(browser, timeout).until(
+            expected_conditions.presence_of_element_located((By.CSS_SELECTOR, WebFetch.pageReadySelectors[pageType])))
+        if pageType == "variation":
+            WebDriverWait(browser, timeout).until(
+                lambda d: len(d.find_element(By.ID, "controls").find_elements(By.TAG_NAME, "button")) > 1)
+            if not WebFetch.isBackButtonOff(browser):
+                controls = browser.find_element(By.ID, "controls")
+                buttons = controls.find_elements(By.TAG_NAME, "button")
+                buttons[1].click()
+                WebDriverWait(browser, ConfigData.BACK_BUTTON_TIMEOUT).until(WebFetch.isBackButtonOff)
+
+    @classmethod
+    def loadHtmlFromWeb(cls, url, profileName, pageType="course"):
+        backend = ConfigData.FETCH_BACKENDS.get(pageType, "selenium")
+        if backend != "selenium":
+            pageHtml = WebFetch.getFetchBackend(backend)(url, profileName, pageType)
+            if pageHtml is not None:
+                return pageHtml
+            Timing.count(backend + " fallback", pageType)
+        return WebFetch.loadHtmlWithBrowser(url, profileName, pageType)
+
+    @classmethod
+    def getFetchBackend(cls, backend):
+        return {"selenium": WebFetch.loadHtmlWithBrowser, "http": WebFetch.loadHtmlWithHttp}[backend]
+
+    @classmethod
+    def loadHtmlWithHttp(cls, url, profileName, pageType="course"):
+        # one try, with the browser profile's session.  A page without the content the browser would wait for (a
+        # login page, or one its scripts haven't filled in) returns None, so the browser fetches it instead
+        if not HttpFetch.hasSession(profileName):
+            WebFetch.loadBrowserSession(profileName)
+        FetchScheduler.waitForTurn()
+        try:
+            with Timing.stage("http get", pageType):
+                status, pageHtml = HttpFetch.get(url)
+        except Exception as e:
+            print(f"error in loadHtmlWithHttp for <{url}> : {e} - using the browser")
+            return None
+        if status != 200 or not WebFetch.hasPageContent(pageHtml, pageType):
+            print("-- <" + url + "> (" + str(status) + ") doesn't have its " + pageType + " content - using the browser")
+            return None
+        Timing.count("http fetched", pageType)
+        return pageHtml
+
+    @classmethod
+    def loadBrowserSession(cls, profileName):
+        # the logged in session lives in the browser profile - ask the browser for its cookies.  All of them, if it's
+        # Chrome (it hasn't been to the site yet, so it has no "current" ones), otherwise whatever it'll give
+        browser = WebFetch.getBrowser(profileName)
+        try:
+            cookies = browser.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]
+        except Exception:
+            cookies = browser.get_cookies()
+        try:
+            userAgent = browser.execute_script("return navigator.userAgent")
+        except Exception:
+            userAgent = None
+        HttpFetch.setSession(profileName, cookies, userAgent)
+
+    @classmethod
+    def hasPageContent(cls, pageHtml, pageType):
+        # the same check waitUntilReady makes in the browser - a search of the raw page, since getHtml parses it next
+        return PAGE_READY_MARKERS[pageType].search(pageHtml) is not None
+
+    @classmethod
+    def loadHtmlWithBrowser(cls, url, profileName, pageType="course"):
+        # print("Reading "+url+" using "+profileName)
+        # attempts are spaced out by FetchScheduler - the rate limit, backoff between retries, and the circuit breaker
+        for retry in range(ConfigData.FETCH_ATTEMPTS):
+            if retry > 0:
+                FetchScheduler.backOff(retry)
+            FetchScheduler.waitForTurn()
+            try:
+                browser = WebFetch.getBrowser(profileName)
+                start = time.perf_counter()
+                with Timing.stage("browser.get", pageType):
+                    browser.get(url)
+                with Timing.stage("page ready", pageType):
+                    WebFetch.waitUntilReady(browser, pageType)
+                WebFetch.pageLatencies.setdefault(pageType, []).append(time.perf_counter() - start)
+                with Timing.stage("page_source", pageType):
+                    outText = browser.page_source
+                WebFetch.browserPages += 1
+                WebFetch.navigateCount += 1
+                WebFetch.navigateTime += time.perf_counter() - start
+                FetchScheduler.recordResult(True)
                 return outText
             except Exception as e:
                 print("error in loadHtmlFromWeb for <" + url + "> on attempt :" + str(retry), end="")
                 exception_message = e.args[0] if e.args else "No message"
                 print(f": : {exception_message}")
+                Timing.count("fetch retry", pageType)
+                FetchScheduler.recordResult(False)
+                # a page that never got its content doesn't mean the browser is broken.  Anything else, the session
+                # may be wedged - start the next attempt with a fresh browser
+                if not isinstance(e, TimeoutException):
+                    WebFetch.closeBrowser()
 
+        Timing.count("fetch failed", pageType)
         return None
+
+
+# make sure chrome doesn't outlive us, however the run ends
+atexit.register(WebFetch.closeBrowser)
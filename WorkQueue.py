@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Filename: WorkQueue.py
+Author: John DeMastri
+Create Date: 2025-05-24
+Version: 0.1
+Description: The pages still to fetch for a whole run - every requested course and the one-off variations - so fetch
+workers always have something to do.  A course starts out as its course page.  Fetching that adds its chapter pages,
+and fetching a chapter page adds its variations (a course with an up to date manifest goes straight to its
+variations).  Course and chapter pages go ahead of variations, since they're what turns up more work, and the
+variations are handed out in the order SCHEDULE_ORDER asks for:
+  given - courses in the order they were asked for, then the one-off variations
+  oneoffs - the one-off variations first, then courses in the order they were asked for
+  smallest - the course with the fewest variations first (one-offs count as a course of their own)
+A course is complete once all of its pages are done, so it can be written while the rest of the run is fetched.
+
+License: MIT License
+Contact: chess@demastri.com
+"""
+from collections import deque
+
+
+class WorkQueue:
+    ONE_OFF = "one-off"  # the course id one-off variations are kept under
+    orderNames = ["given", "oneoffs", "smallest"]
+
+    def __init__(self, order="given", isWanted=None):
+        self.order = order
+        # (courseId, variationId) -> False for a variation that doesn't need fetching (already cached, another shard)
+        self.isWanted = isWanted
+        self.indexItems = deque()  # course and chapter pages
+        self.variationItems = {}  # courseId -> variations waiting to be handed out
+        self.courseOrder = []
+        self.sizes = {}  # variations in each course, as far as is known yet
+        self.outstanding = {}  # pages added to each course and not done yet
+        self.running = 0  # pages handed out and not done yet - kept by the caller
+
+    def addCourse(self, courseId, manifest=None):
+        # returns [courseId] if there's nothing to fetch for it, so it's already complete
+        self.startCourse(courseId)
+        if manifest is None:
+            self.addItem(("course", courseId, courseId))
+        else:
+            for chapter in manifest["chapters"]:
+                self.addVariations(courseId, [v["id"] for v in chapter["variations"]])
+        return self.getCompleted(courseId)
+
+    def addOneOffs(self, variationIds):
+        if len(variationIds) == 0:
+            return []
+        self.startCourse(WorkQueue.ONE_OFF)
+        self.addVariations(WorkQueue.ONE_OFF, variationIds)
+        return self.getCompleted(WorkQueue.ONE_OFF)
+
+    def startCourse(self, courseId):
+        if courseId not in self.outstanding:
+            self.courseOrder.append(courseId)
+            self.outstanding[courseId] = 0
+            self.sizes[courseId] = 0
+            self.variationItems[courseId] = deque()
+
+    def addItem(self, item):
+        kind, courseId, itemId = item
+        self.outstanding[courseId] += 1
+        if kind == "variation":
+            self.variationItems[courseId].append(item)
+        else:
+            self.indexItems.append(item)
+
+    def addVariations(self, courseId, variationIds):
+        self.sizes[courseId] += len(variationIds)
+        for variationId in variationIds:
+            if self.isWanted is None or self.isWanted(courseId, variationId):
+                self.addItem(("variation", courseId, variationId))
+
+    def nextItem(self):
+        # the next page to fetch, or None if there's nothing to hand out right now
+        if self.order == "oneoffs" and len(self.variationItems.get(WorkQueue.ONE_OFF, [])) > 0:
+            return self.variationItems[WorkQueue.ONE_OFF].popleft()
+        if len(self.indexItems) > 0:
+            return self.indexItems.popleft()
+        waiting = [c for c in self.courseOrder if len(self.variationItems[c]) > 0]
+        if len(waiting) == 0:
+            return None
+        # courses are kept in the order they were asked for, with the one-offs added last
+        courseId = min(waiting, key=lambda c: self.sizes[c]) if self.order == "smallest" else waiting[0]
+        return self.variationItems[courseId].popleft()
+
+    def finish(self, item, children):
+        # item is done - children are the chapter ids (for a course page) or variation ids (for a chapter page) it
+        # listed.  Returns [courseId] if that completed its course
+        kind, courseId, itemId = item
+        if kind == "course":
+            for chapterId in children:
+                self.addItem(("chapter", courseId, chapterId))
+        elif kind == "chapter":
+            self.addVariations(courseId, children)
+        self.outstanding[courseId] -= 1
+        return self.getCompleted(courseId)
+
+    def getCompleted(self, courseId):
+        return [courseId] if self.outstanding[courseId] == 0 else []
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Filename: WorkerPool.py
+Author: John DeMastri
+Create Date: 2025-05-12
+Version: 0.1
+Description: Spreads variation work across processes.
+Fetching: Chrome locks its profile, so two sessions can't share the logged in testing profile.  Each worker process gets
+its own copy of that profile.  fetchLibrary() hands them pages from one WorkQueue for the whole run - course, chapter
+and variation pages of every course - so they don't sit idle while one course's chapters are read.  Fetch workers only
+fill the html cache - pgn is still written by the main process, in course order, from the cached files, for each
+course as soon as its pages are in.
+Rendering: parsing and pgn generation from cached html is pure cpu work, so it can use every core.  Results come back
+in the order they were handed out, which keeps the course pgn in Round order.
+Pipelining: fetchAhead() runs the browser on a background thread of the main process, a bounded number of variations
+ahead of whatever is being rendered, so page loads and rendering overlap.
+
+License: MIT License
+Contact: chess@demastri.com
+"""
+import multiprocessing
+import multiprocessing.util
+import os
+import queue
+import shutil
+import tempfile
+import threading
+
+import ConfigData
+from CourseManifest import CourseManifest
+from FetchScheduler import FetchScheduler
+from Shards import Shards
+from WorkQueue import WorkQueue
+from WebFetch import WebFetch
+from Pgn import Pgn
+from Timing import Timing
+
+# lock files from a running browser, and caches that don't need to come along with the login
+PROFILE_COPY_IGNORE = shutil.ignore_patterns("Singleton*", "lockfile", "LOCK", "Cache", "Code Cache", "GPUCache",
+                                             "Service Worker", "ShaderCache", "GrShaderCache")
+
+workerNumber = None
+workerRoot = None
+
+
+def getConfigSnapshot():
+    # command line options live in module state - on Windows workers are spawned fresh, so hand them over explicitly
+    config = {k: v for k, v in vars(ConfigData).items() if k.isupper()}
+    return config, WebFetch.doFetch, Pgn.PGN_WRITE_KEY_MOVE, WebFetch.driverFactory, Timing.logName
+
+
+def applyConfigSnapshot(snapshot):
+    config, doFetch, writeKeyMove, driverFactory, timingLogName = snapshot
+    for k, v in config.items():
+        setattr(ConfigData, k, v)
+    WebFetch.doFetch = doFetch
+    Pgn.PGN_WRITE_KEY_MOVE = writeKeyMove
+    WebFetch.driverFactory = driverFactory
+    # worker events go to the run's log, so they show up in its summary
+    Timing.logName = timingLogName
+
+
+def copyProfile(profileName, destDir):
+    # a chrome user data dir is "Local State" (holds the cookie key) plus one folder per profile
+    srcDir = ConfigData.TESTING_PROFILE_BASE_DIR
+    os.makedirs(destDir, exist_ok=True)
+    localState = os.path.join(srcDir, "Local State")
+    if os.path.exists(localState):
+        shutil.copy2(localState, destDir)
+    shutil.copytree(os.path.join(srcDir, profileName), os.path.join(destDir, profileName),
+                    ignore=PROFILE_COPY_IGNORE, dirs_exist_ok=True)
+
+
+def initWorker(snapshot, profileName, profileRoot, counter, fetchSchedule):
+    global workerNumber
+    global workerRoot
+    applyConfigSnapshot(snapshot)
+    # the rate limit and circuit breaker cover every worker, not each one
+    FetchScheduler.useSharedState(fetchSchedule)
+    with counter.get_lock():
+        counter.value += 1
+        workerNumber = counter.value
+    workerRoot = os.path.join(profileRoot, "worker-" + str(workerNumber))
+    copyProfile(profileName, workerRoot)
+    ConfigData.TESTING_PROFILE_BASE_DIR = workerRoot
+    # pool workers skip atexit handlers, so close the browser from multiprocessing's own exit hook
+    multiprocessing.util.Finalize(None, WebFetch.closeBrowser, exitpriority=10)
+
+
+def fetchPage(item, profileName):
+    # item is a WorkQueue page - ("course" | "chapter" | "variation", courseId, id).  Returns it with whether it's
+    # now cached, the ids it lists (chapters of a course, variations of a chapter) and whether the cached copy had to
+    # stand in for it because it couldn't be fetched again
+    kind, courseId, itemId = item
+    try:
+        if kind == "course":
+            bs, chapterTags = WebFetch.getCourseDetail(courseId, profileName)
+            ok, children = bs is not None, [WebFetch.getChapterIdFromTag(t) for t in chapterTags]
+        elif kind == "chapter":
+            bs = WebFetch.getChapterHtml(courseId, itemId, profileName)
+            variationTags = [] if bs is None else WebFetch.getChapterVariations(bs)
+            ok, children = bs is not None, [WebFetch.getVariationIdFromTag(v) for v in variationTags]
+        else:
+            ok, children = WebFetch.fetchVariationHtml(itemId, courseId, profileName) is not None, []
+        return item, ok, children, getPageLocation(item) in WebFetch.refetchFailed
+    except Exception as e:
+        print("error fetching " + kind + " " + courseId + "-" + itemId + " : " + str(e))
+        return item, False, [], False
+
+
+def getPageLocation(item):
+    kind, courseId, itemId = item
+    if kind == "course":
+        return WebFetch.getLocation("course", courseId)
+    if kind == "chapter":
+        return WebFetch.getLocation("course", courseId + "/" + itemId)
+    return WebFetch.getVariationLocation(itemId, courseId)
+
+
+def isVariationWanted(courseId, variationId):
+    if courseId != WorkQueue.ONE_OFF and Shards.isSharded() and not Shards.isInShard(variationId):
+        return False
+    location = WebFetch.getVariationLocation(variationId, courseId)
+    if location in FetchScheduler.gaveUp:
+        return False
+    if WebFetch.doFetch in [WebFetch.FETCH_NEW, WebFetch.FETCH_REFRESH]:
+        return not WebFetch.isCached(location)
+    return True
+
+
+def fetchLibrary(courses, variations, profileName):
+    # fetches the pages for every course and the one-off variations with FETCH_WORKERS browsers, from one queue.
+    # Yields each course id (WorkQueue.ONE_OFF for the one-offs) as soon as all its pages are cached - the workers
+    # keep fetching for the rest of the run while the caller writes it
+    work = WorkQueue(ConfigData.SCHEDULE_ORDER, isVariationWanted)
+    completed = queue.Queue()
+    for courseId in courses:
+        # a course whose manifest is up to date (and isn't being refetched) doesn't need its course and chapter pages
+        for c in work.addCourse(courseId, CourseManifest.loadManifest(courseId)):
+            completed.put(c)
+    for c in work.addOneOffs(variations):
+        completed.put(c)
+
+    workers = ConfigData.FETCH_WORKERS
+    # every worker copies the profile as it starts - without one they'd all fail there, and the pool with them
+    profileDir = os.path.join(ConfigData.TESTING_PROFILE_BASE_DIR, profileName)
+    if not os.path.isdir(profileDir):
+        raise FileNotFoundError("no browser profile at " + profileDir + " for the fetch workers to copy - set "
+                                "TESTING_PROFILE_BASE_DIR or -browserProfileDir")
+    print("--- fetching " + str(len(courses)) + " courses and " + str(len(variations)) + " variations with " +
+          str(workers) + " workers, " + ConfigData.SCHEDULE_ORDER + " order ---")
+    profileRoot = tempfile.mkdtemp(prefix="chessable-profiles-")
+    counter = multiprocessing.Value('i', 0)
+    lock = threading.Lock()
+    fetched = [0, 0]  # pages fetched, pages failed
+
+    try:
+        with multiprocessing.Pool(workers, initializer=initWorker,
+                                  initargs=(getConfigSnapshot(), profileName, profileRoot, counter,
+                                            FetchScheduler.getSharedState())) as pool:
+
+            def dispatch():
+                # with lock held.  A couple of pages per worker are handed out, so none waits on this process.
+                # This runs on the pool's result thread as pages finish, so it keeps going while the caller writes pgn
+                while work.running < 2 * workers:
+                    item = work.nextItem()
+                    if item is None:
+                        break
+                    work.running += 1
+                    pool.apply_async(fetchPage, (item, profileName), callback=pageDone,
+                                     error_callback=lambda e, page=item: pageFailed(page, e))
+                if work.running == 0:
+                    completed.put(None)
+
+            def pageDone(result):
+                with lock:
+                    try:
+                        item, ok, children, stale = result
+                        work.running -= 1
+                        if ok and stale:
+                            fetched[1] += 1
+                            WebFetch.markRefetchFailed(getPageLocation(item), item[0])
+                        elif ok:
+                            fetched[0] += 1
+                            WebFetch.fetchedThisRun.add(getPageLocation(item))
+                        else:
+                            fetched[1] += 1
+                            print(" - no HTML fetched for " + item[0] + " " + item[1] + "-" + item[2])
+                            WebFetch.queueRetry(getPageLocation(item), item[0])
+                        for c in work.finish(item, children):
+                            completed.put(c)
+                        dispatch()
+                    except Exception as e:
+                        # this runs on the pool's result thread - an error here would otherwise leave the caller
+                        # waiting for courses that never come
+                        print("error handling fetched page " + str(result) + " : " + str(e))
+                        completed.put(None)
+
+            def pageFailed(item, error):
+                # fetchPage catches its own errors, so this is the pool failing to run it or to send its result back
+                print("error fetching " + item[0] + " " + item[1] + "-" + item[2] + " : " + str(error))
+                pageDone((item, False, [], False))
+
+            with lock:
+                dispatch()
+            while True:
+                courseId = completed.get()
+                if courseId is None:
+                    break
+                yield courseId
+            pool.close()
+            pool.join()
+    finally:
+        shutil.rmtree(profileRoot, ignore_errors=True)
+    print("--- " + str(fetched[0]) + " pages fetched, " + str(fetched[1]) + " failed ---")
+
+
+def initRenderWorker(snapshot):
+    applyConfigSnapshot(snapshot)
+    # render workers only ever read the cache
+    WebFetch.doFetch = WebFetch.FETCH_NONE
+
+
+def renderVariation(task):
+    courseId, variationId, roundStr = task
+    variationText = WebFetch.getVariationText(variationId, courseId, "Default")
+    if variationText is None:
+        print(" - no HTML found for variation " + variationId)
+        return None
+    return Pgn.createPgnFromText(courseId, variationId, variationText, roundStr)
+
+
+def renderCoursePgn(courseId, tasks):
+    # tasks is a list of (variationId, roundStr, name) in course order.  Yields each variation's pgn, in that same
+    # order, as soon as it and everything before it are rendered - the whole course is never held at once
+    workers = min(ConfigData.RENDER_WORKERS, max(len(tasks), 1))
+    print(" Rendering Course PGN file for course " + courseId + " with " + str(workers) + " processes")
+    with multiprocessing.Pool(workers, initializer=initRenderWorker, initargs=(getConfigSnapshot(),)) as pool:
+        for pgnOut in pool.imap(renderVariation, [(courseId, v, r) for v, r, n in tasks],
+                                chunksize=max(1, min(len(tasks) // (workers * 8), 64))):
+            if pgnOut is not None:
+                yield pgnOut
+
+
+def fetchAhead(function, items, depth):
+    # yields function(item) for each item, in order.  A background thread works through items, up to depth results
+    # ahead of the caller, so the browser keeps loading pages while the caller renders.  Only that thread touches the
+    # browser until this finishes.  An error on the thread is raised here, in order, after the results before it
+    results = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def offer(entry):
+        while not stop.is_set():
+            try:
+                results.put(entry, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not offer(("result", function(item))):
+                    return
+        except BaseException as e:
+            offer(("error", e))
+            return
+        offer(("done", None))
+
+    thread = threading.Thread(target=produce, name="fetchAhead", daemon=True)
+    thread.start()
+    try:
+        while True:
+            kind, value = results.get()
+            if kind == "done":
+                break
+            if kind == "error":
+                raise value
+            yield value
+    finally:
+        # let the thread finish the page it's on, so the browser is free again
+        stop.set()
+        thread.join()
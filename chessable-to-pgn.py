@@ -13,10 +13,20 @@ Contact: chess@demastri.com
 
 from datetime import datetime
 
-from bs4 import BeautifulSoup
-
 import CommandLine
+import ConfigData
+import WorkerPool
+from HtmlStore import HtmlStore
+from CourseManifest import CourseManifest
+from FetchScheduler import FetchScheduler
+from OpeningBook import OpeningBook
+from PositionIndex import PositionIndex
+from RenderCache import RenderCache
+from RunJournal import RunJournal
+from Shards import Shards
+from Timing import Timing
 from WebFetch import WebFetch
+from WorkQueue import WorkQueue
 from Pgn import Pgn
 
 profileIds = []
@@ -43,6 +53,20 @@ def main():
                     Pgn.doPgn] + " written")
     elif processMode == "batch":
         processBatch(courses, variations)
+    elif processMode == "migrate":
+        HtmlStore.migrateFromFiles(ConfigData.HTML_CACHE_PATH)
+    elif processMode == "merge":
+        for courseId in courses:
+            Shards.mergeCourse(courseId)
+    elif processMode == "book":
+        Timing.startRun()
+        try:
+            OpeningBook.writeBook(courses, variations)
+        finally:
+            Timing.printSummary()
+            Timing.closeLog()
+    elif processMode == "findfen":
+        PositionIndex.printMatches(PositionIndex.findFen, courses)
     else:
         print("unknown process mode <" + processMode + ">")
 
@@ -53,121 +77,243 @@ def main():
 
 
 def processBatch(courses, variations):
-    for courseId in courses:
-        print("--- Processing course " + courseId + " fetch: " + WebFetch.flagNames[WebFetch.doFetch] + " pgn: " +
-              Pgn.flagNames[Pgn.doPgn])
-        # print("--- getting variation html ---")
-        courseBS, chapters = loadCourseInfo(courseId)
-        # this first pass loads/saves all of the chapter htmls
-        # running single-threaded - an hour trying to get threading and processing failed (selenium issues)
-        print("----------")
-
-        chapterResults = loadChapterInfo(courseId, chapters)
-        # once we have the chapter details, we can load all of the variation htmls
-        if Pgn.doPgn == Pgn.PGN_INCREMENTAL:
-            appendToFile = False
-            for i in range(len(chapterResults)):
-                bset, vset = chapterResults[i]
-                # get each variation individually
-                for vi in range(len(vset)):
-                    thisVarDet = WebFetch.getVariationDetailFromTag(courseId, vset[vi], "Default")
-                    thisVarDet.append(str(i + 1) + "." + str(vi + 1))
-                    pgnOut = generateCoursePGNs(courseId, [thisVarDet])
-                    Pgn.writeCoursePgnFile(courseId, pgnOut, appendToFile)
-                    appendToFile = True
-        elif Pgn.doPgn == Pgn.PGN_AFTER:
-            variationResults = loadVariationInfo(courseId, chapterResults)
-            # now all of the variation htmls are available locally
-            pgnOut = generateCoursePGNs(courseId, variationResults)
-            Pgn.writeCoursePgnFile(courseId, pgnOut, False)
-        else:
-            # still get the html even if we're not doing pgn...
-            loadVariationInfo(courseId, chapterResults)
-
-        print("----------")
+    Timing.startRun()
+    WebFetch.startRun()
+    FetchScheduler.startRun()
+    try:
+        processItems(courses, variations)
+        retryFailedFetches()
+    finally:
+        WebFetch.closeBrowser()
+        WebFetch.printFetchStats()
+        if ConfigData.RENDER_CACHE:
+            RenderCache.prune()
+        PositionIndex.close()
+        Timing.printSummary()
+        Timing.closeLog()
+
 
+def processItems(courses, variations):
+    if Shards.isSharded():
+        variations = [v for v in variations if Shards.isInShard(v)]
+    if ConfigData.FETCH_WORKERS > 1 and WebFetch.doFetch != WebFetch.FETCH_NONE:
+        # fill the html cache in parallel, for all of the courses at once.  Each course is written (from the cache, in
+        # course order) as soon as its pages are in, while the workers carry on with the rest
+        for courseId in WorkerPool.fetchLibrary(courses, variations, "Default"):
+            if courseId == WorkQueue.ONE_OFF:
+                for variationId in variations:
+                    processVariation(variationId)
+            else:
+                processCourse(courseId)
+        return
+    for courseId in courses:
+        processCourse(courseId)
     for variationId in variations:
-        courseId = "one-off"
-        print("--- Processing variation " + variationId + " fetch: " + WebFetch.flagNames[WebFetch.doFetch] + " pgn: " +
-              Pgn.flagNames[Pgn.doPgn])
-        thisVarResult = WebFetch.getVariationDetailFromId(courseId, variationId, "Default")
-        if thisVarResult is None:
-            continue
-        thisVarResult.append("x.x")
-        if Pgn.doPgn != Pgn.PGN_NONE:
-            # in this case there's no distinction between incremental / after
-            pgnOut = generateCoursePGNs(courseId, [thisVarResult])
-            Pgn.writeVariationPgnFile(variationId, pgnOut)
+        processVariation(variationId)
+
+
+def processCourse(courseId):
+    print("--- Processing course " + courseId + " fetch: " + WebFetch.flagNames[WebFetch.doFetch] + " pgn: " +
+          Pgn.flagNames[Pgn.doPgn])
+    # print("--- getting variation html ---")
+    # this first pass loads/saves the course and all of the chapter htmls (or reads the course manifest)
+    chapterResults = loadCourseInfo(courseId)
+    print("----------")
+
+    variationTasks = getVariationTasks(chapterResults)
+    if WebFetch.doFetch == WebFetch.FETCH_REFRESH:
+        reportCourseChanges(courseId, variationTasks)
+    if Shards.isSharded():
+        # the fragment is marked with the whole course, so -merge can tell the shards came from the same course
+        runKey = RunJournal.getRunKey(courseId, variationTasks)
+        variationTasks = [t for t in variationTasks if Shards.isInShard(t[0])]
+        print("----- shard " + str(ConfigData.SHARD_INDEX) + " of " + str(ConfigData.SHARD_COUNT) + " has " +
+              str(len(variationTasks)) + " of the course's variations")
+    # once we have the chapter details, we can load all of the variation htmls
+    if Pgn.doPgn != Pgn.PGN_NONE and Shards.isSharded():
+        # this machine's share of the course, tagged with Round, for -merge to put back together
+        print(" Writing shard fragment for course " + courseId)
+        Shards.writeFragment(courseId, runKey,
+                             iterCourseFragments(courseId, iterVariationInfo(courseId, variationTasks)))
+    elif Pgn.doPgn != Pgn.PGN_NONE and ConfigData.RENDER_WORKERS > 1 and (
+            Pgn.doPgn == Pgn.PGN_AFTER or WebFetch.doFetch == WebFetch.FETCH_NONE):
+        # nothing to interleave with rendering - cache everything first, then render on all cores
+        if WebFetch.doFetch != WebFetch.FETCH_NONE:
+            for variationId, roundStr, name in variationTasks:
+                WebFetch.fetchVariationHtml(variationId, courseId, "Default")
+        Pgn.writeCoursePgnStream(courseId, WorkerPool.renderCoursePgn(courseId, variationTasks))
+        if ConfigData.POSITION_INDEX:
+            indexCoursePositions(courseId, variationTasks)
+    elif Pgn.doPgn == Pgn.PGN_INCREMENTAL:
+        # the journal records each variation once it's written, so an interrupted run carries on from there
+        runKey = RunJournal.getRunKey(courseId, variationTasks)
+        variationsDone = RunJournal.resume(courseId, runKey, lambda v: isVariationAvailable(courseId, v)) \
+            if ConfigData.RESUME_RUNS else 0
+        if variationsDone == 0:
+            RunJournal.start(courseId, runKey)
+        appendToFile = variationsDone > 0
+        # get each variation individually
+        for thisVarDet in iterVariationDetails(courseId, variationTasks[variationsDone:]):
+            pgnOut = generateCoursePGNs(courseId, [thisVarDet])
+            Pgn.writeCoursePgnFile(courseId, pgnOut, appendToFile)
+            RunJournal.commit(courseId, thisVarDet[2], thisVarDet[1], thisVarDet[0] is None)
+            appendToFile = True
+        RunJournal.finish(courseId)
+    elif Pgn.doPgn == Pgn.PGN_AFTER:
+        # each variation is loaded, rendered and written before the next one is read, so only one is held at a
+        # time.  The course file is replaced once the whole course is written
+        print(" Writing Course PGN file for course " + courseId)
+        Pgn.writeCoursePgnStream(courseId, iterCoursePGNs(courseId, iterVariationInfo(courseId, variationTasks)))
+    else:
+        # still get the html even if we're not doing pgn...
+        loadVariationInfo(courseId, variationTasks)
+
+    print("----------")
+
+
+def processVariation(variationId):
+    courseId = WorkQueue.ONE_OFF
+    print("--- Processing variation " + variationId + " fetch: " + WebFetch.flagNames[WebFetch.doFetch] + " pgn: " +
+          Pgn.flagNames[Pgn.doPgn])
+    thisVarResult = WebFetch.getVariationDetailFromId(courseId, variationId, "Default")
+    if thisVarResult is None:
+        return
+    thisVarResult.append("x.x")
+    if Pgn.doPgn != Pgn.PGN_NONE:
+        # in this case there's no distinction between incremental / after
+        pgnOut = generateCoursePGNs(courseId, [thisVarResult])
+        Pgn.writeVariationPgnFile(variationId, pgnOut)
+
+
+def retryFailedFetches():
+    # pages that failed every attempt get one more try once everything else is done.  Courses (and one-off variations)
+    # that gain pages from it are processed again - from the cache now - so their pgn includes them
+    fetched = WebFetch.retryFailedFetches("Default")
+    while len(fetched) > 0:
+        courses = []
+        variations = []
+        for location in fetched:
+            courseId = location.split("/")[1]
+            if courseId == WorkQueue.ONE_OFF:
+                variations.append(location.split("/")[-1])
+            elif courseId not in courses:
+                courses.append(courseId)
+        processItems(courses, variations)
+        # processing them again can turn up pages that weren't known before (like the variations of a chapter)
+        fetched = WebFetch.retryFailedFetches("Default")
 
 
 def loadCourseInfo(courseId):
     print("--- getting course html for course " + courseId + " ---")
-    courseBS, chapters = WebFetch.getCourseDetail(courseId, "Default")
-    print("----- found course '" + WebFetch.getCourseName(courseBS) + "'")
-    print("----- read " + str(len(chapters)) + " chapters")
-    return courseBS, chapters
-
-
-def loadChapterInfo(courseId, chapters):
-    chapterResults = []
-
-    chaptersRead = 0
-    varsPreviewed = 0
-    for c in chapters:
-        thisResult = processChapter(courseId, str(c), "Default")
-        varsPreviewed += len(thisResult[1])
-        chapterResults.append(thisResult)
-        chaptersRead += 1
-        if chaptersRead > 500:
-            break
+    manifest = CourseManifest.getManifest(courseId, "Default")
+    print("----- found course '" + manifest["name"] + "'")
+    print("----- read " + str(len(manifest["chapters"])) + " chapters")
+    varsPreviewed = sum(len(c["variations"]) for c in manifest["chapters"])
     print(" - total of " + str(varsPreviewed) + " - variations previewed - ")
-    return chapterResults
+    return manifest["chapters"]
+
 
+def loadVariationInfo(courseId, variationTasks):
+    for thisVarDet in iterVariationInfo(courseId, variationTasks):
+        pass
 
-def loadVariationInfo(courseId, chapterResults):
-    variationResults = []
 
+def iterVariationInfo(courseId, variationTasks):
+    # yields [variationText, variationId, roundStr] for each variation with html, in course order, as it's loaded
     variationsRead = 0
-    chapterNbr = 0  # used to build round string
-    variationNbr = 0  # used to build round string
-    for b, v in chapterResults:
-        chapterNbr += 1
-        variationNbr = 0
-        for variation in v:
-            variationNbr += 1
-            thisVarDet = WebFetch.getVariationDetailFromTag(courseId, variation, "Default")
-            if thisVarDet[0] is None:
-                print(" - no HTML found for variation " + thisVarDet[1])
-                continue
-            roundStr = str(chapterNbr) + "." + str(variationNbr)
-            thisVarDet.append(roundStr)
-            variationResults.append(thisVarDet)
-            variationsRead += 1
-            if variationsRead > 5000:
-                break
-        if variationsRead > 5000:
-            break
+    for thisVarDet in iterVariationDetails(courseId, variationTasks):
+        if thisVarDet[0] is None:
+            print(" - no HTML found for variation " + thisVarDet[1])
+            continue
+        variationsRead += 1
+        yield thisVarDet
     print(" - total of " + str(variationsRead) + " - variations read - ")
-    return variationResults
+
+
+def iterVariationDetails(courseId, variationTasks):
+    # [variationText, variationId, roundStr] for every variation, in course order.  With -pipeline the next ones are
+    # fetched on a separate thread while the caller renders this one
+    if ConfigData.FETCH_PIPELINE:
+        return WorkerPool.fetchAhead(lambda task: loadVariationDetail(courseId, task), variationTasks,
+                                     ConfigData.PIPELINE_DEPTH)
+    return (loadVariationDetail(courseId, task) for task in variationTasks)
+
+
+def loadVariationDetail(courseId, variationTask):
+    variationId, roundStr, name = variationTask
+    thisVarDet = WebFetch.getVariationDetail(courseId, variationId, name, "Default")
+    thisVarDet.append(roundStr)
+    return thisVarDet
+
+
+def isVariationAvailable(courseId, variationId):
+    # could this run get the variation's html - it's cached now, or it may be fetched
+    location = WebFetch.getVariationLocation(variationId, courseId)
+    return WebFetch.doFetch != WebFetch.FETCH_NONE or WebFetch.isCached(location)
+
+
+def reportCourseChanges(courseId, variationTasks):
+    # the course and chapter pages were just fetched again - compare the variations they list with what's cached
+    cached = set(WebFetch.listCachedLocations(WebFetch.getLocation("variation", "", "course/" + courseId) + "/"))
+    listed = set(WebFetch.getVariationLocation(v, courseId) for v, r, n in variationTasks)
+    removed = sorted(cached - listed)
+    # with -workers the new variations are already in by now - they count as well as the ones still to fetch
+    missing = [location for location in listed if not WebFetch.isCached(location) or
+               (location in WebFetch.fetchedThisRun and location not in WebFetch.refetchFailed)]
+    print("----- refresh: " + str(len(listed)) + " variations in course, " + str(len(missing)) +
+          " new or missing (fetched this run or still to fetch)")
+    # a course or chapter page that couldn't be fetched again may not list everything the course has now, so what
+    # isn't listed can't be called removed
+    courseLocation = WebFetch.getLocation("course", courseId)
+    failedLocations = WebFetch.refetchFailed | set(r[0] for r in FetchScheduler.retryQueue)
+    stalePages = [location for location in failedLocations if "/variation/" not in location and
+                  (location == courseLocation or location.startswith(courseLocation + "/"))]
+    if len(stalePages) > 0:
+        print("----- refresh: " + str(len(stalePages)) + " course or chapter pages couldn't be fetched again - "
+              "not checking for variations that are no longer in the course")
+        return
+    print("----- refresh: " + str(len(removed)) + " variations cached but no longer in the course")
+    for location in removed:
+        print(" - variation " + location.split("/")[-1] + " is no longer in course " + courseId)
+
+
+def getVariationTasks(chapterResults):
+    # (variationId, roundStr, name) for every variation in the course, in course order
+    tasks = []
+    for i in range(len(chapterResults)):
+        vset = chapterResults[i]["variations"]
+        for vi in range(len(vset)):
+            tasks.append((vset[vi]["id"], str(i + 1) + "." + str(vi + 1), vset[vi]["name"]))
+    return tasks
 
 
 def generateCoursePGNs(courseId, variationResults):
     print(" Writing Course PGN file for course "+courseId)
-    aggregatePgn = ""
-    for [variation, variationId, roundStr] in variationResults:
-        pgnOut = Pgn.createPgnFromHtml(courseId, variationId, variation, roundStr)
+    return "".join(iterCoursePGNs(courseId, variationResults))
+
+
+def iterCoursePGNs(courseId, variationResults):
+    for roundStr, variationId, pgnOut in iterCourseFragments(courseId, variationResults):
+        yield pgnOut
+
+
+def iterCourseFragments(courseId, variationResults):
+    # renders each variation as it's needed - the html (and its parse tree) is released before the next one
+    for [variationText, variationId, roundStr] in variationResults:
+        pgnOut = Pgn.createPgnFromText(courseId, variationId, variationText, roundStr)
         if pgnOut is not None:
-            aggregatePgn += pgnOut
-    return aggregatePgn
+            if ConfigData.POSITION_INDEX:
+                # after rendering, so the move tree is usually in the tree cache by now
+                PositionIndex.addVariation(courseId, variationId, roundStr, variationText)
+            yield roundStr, variationId, pgnOut
 
 
-def processChapter(courseId, tagStr, profileName):
-    chapter = BeautifulSoup(tagStr, "html.parser")
-    print("Parsing '" + WebFetch.getChapterName(chapter) + "' (" + profileName + ") ")
-    chapterBS, variations = WebFetch.getChapterDetail(courseId, chapter, profileName)
-    print(" returned  '" + WebFetch.getChapterName(chapter) + "' had (" + profileName + ") " + str(
-        len(variations)) + " variations")
-    return [chapterBS, variations]
+def indexCoursePositions(courseId, variationTasks):
+    # the render workers don't touch the index - the variations they rendered are added from the cache here
+    for variationId, roundStr, name in variationTasks:
+        variationText = WebFetch.getVariationText(variationId, courseId, "Default")
+        if variationText is not None:
+            PositionIndex.addVariation(courseId, variationId, roundStr, variationText)
 
 
 if __name__ == "__main__":